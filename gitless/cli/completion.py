@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""Tab completion.
+
+Building gl's full parser means importing every subcommand (and with them
+pygit2 and gitless.core) and opening the repository, which is too slow to do
+on each TAB press. So the first time we complete in a repository we build the
+full parser and save what argcomplete needs from it (the subcommands, their
+flags and arguments and the names of branches, tags and remotes) to a cache
+file in the git dir. Next time, if the cache is still fresh, we rebuild a
+lightweight parser from it instead.
+
+The cache is invalidated if the version of Gitless or the repository's refs,
+index or config change.
+"""
+
+
+import argparse
+import json
+import os
+
+
+CACHE_FILE = 'GL_COMPLETION_CACHE'
+
+# The kinds of names a RefCompleter completes
+BRANCH = 'branch'
+REMOTE_BRANCH = 'remote_branch'
+TAG = 'tag'
+REMOTE = 'remote'
+
+
+class RefCompleter(object):
+  """argcomplete completer for the names of branches, tags or remotes.
+
+  Args:
+    repo: the repository to take the names from.
+    kinds: the kinds of names to complete (BRANCH, REMOTE_BRANCH, TAG or
+      REMOTE).
+  """
+
+  def __init__(self, repo, *kinds):
+    self.repo = repo
+    self.kinds = kinds
+
+  def __call__(self, **kwargs):
+    if not self.repo:
+      return []
+    return [n for kind in self.kinds for n in ref_names(self.repo, kind)]
+
+
+def ref_names(repo, kind):
+  """Returns the names of the given kind (BRANCH, TAG, etc) of repo."""
+  import pygit2
+  if kind == BRANCH:
+    return repo.listall_branches()
+  if kind == REMOTE_BRANCH:
+    # We don't use Remote.listall_branches since it goes to the network
+    return [
+        b for b in repo.git_repo.listall_branches(pygit2.GIT_BRANCH_REMOTE)
+        if not b.endswith('/HEAD')]
+  if kind == TAG:
+    return list(repo.listall_tags())
+  if kind == REMOTE:
+    return [r.name for r in repo.remotes]
+  raise ValueError('Unknown kind {0}'.format(kind))
+
+
+def autocomplete(version, build_parser, repo):
+  """Completes the command line being completed and exits.
+
+  Args:
+    version: the version of Gitless.
+    build_parser: a function that returns gl's full parser.
+    repo: the repository of the cwd.
+  """
+  import argcomplete
+
+  git_dir = _find_git_dir(os.getcwd())
+  if not git_dir:
+    argcomplete.autocomplete(build_parser())
+    return
+
+  cache_fp = os.path.join(git_dir, CACHE_FILE)
+  stamp = _stamp(git_dir, version)
+  try:
+    with open(cache_fp, 'r') as f:
+      cache = json.load(f)
+  except (IOError, ValueError):
+    cache = None
+
+  if not cache or cache['stamp'] != stamp:
+    refs = dict((k, []) for k in (BRANCH, REMOTE_BRANCH, TAG, REMOTE))
+    if repo:
+      refs = dict((k, ref_names(repo, k)) for k in refs)
+    cache = {'stamp': stamp, 'parser': spec(build_parser()), 'refs': refs}
+    try:
+      with open(cache_fp, 'w') as f:
+        json.dump(cache, f)
+    except IOError:  # we can still complete
+      pass
+
+  argcomplete.autocomplete(from_spec(cache['parser'], cache['refs']))
+
+
+def spec(parser):
+  """Returns a JSON-serializable description of the parser given.
+
+  It includes only what's needed for completion. Use from_spec to build a
+  parser out of it.
+  """
+  actions = []
+  for action in parser._actions:
+    if isinstance(action, argparse._HelpAction):
+      continue
+    if isinstance(action, argparse._SubParsersAction):
+      subcmds = []
+      for choice in action._choices_actions:
+        subparser = action.choices[choice.dest]
+        aliases = [
+            n for n, p in action.choices.items()
+            if p is subparser and n != choice.dest]
+        subcmds.append([choice.dest, aliases, choice.help, spec(subparser)])
+      actions.append({'dest': action.dest, 'subcmds': subcmds})
+      continue
+    completer = getattr(action, 'completer', None)
+    actions.append({
+        'option_strings': action.option_strings,
+        'dest': action.dest,
+        'nargs': action.nargs,
+        'metavar': action.metavar,
+        'help': action.help,
+        'choices': list(action.choices) if action.choices else None,
+        'refs': (
+            completer.kinds if isinstance(completer, RefCompleter) else None)})
+  return {'description': parser.description, 'actions': actions}
+
+
+def from_spec(parser_spec, refs, parser=None):
+  """Builds a parser out of the given spec (as returned by spec).
+
+  Args:
+    parser_spec: the spec of the parser.
+    refs: a dict mapping the kinds of names (BRANCH, TAG, etc) to the names to
+      use to complete arguments that take those.
+    parser: the (empty) parser to add the arguments to, if None a new one is
+      created.
+  """
+  import argcomplete
+
+  if parser is None:
+    parser = argparse.ArgumentParser(description=parser_spec['description'])
+  for a in parser_spec['actions']:
+    if 'subcmds' in a:
+      subparsers = parser.add_subparsers(dest=a['dest'])
+      for name, aliases, help, subcmd_spec in a['subcmds']:
+        from_spec(
+            subcmd_spec, refs, parser=subparsers.add_parser(
+                name, aliases=aliases, help=help,
+                description=subcmd_spec['description']))
+      continue
+
+    kwargs = {'dest': a['dest'], 'help': a['help']}
+    if a['nargs'] == 0:
+      kwargs['action'] = 'store_true'
+    else:
+      kwargs.update(nargs=a['nargs'], choices=a['choices'])
+      if isinstance(a['metavar'], str) and a['option_strings']:
+        kwargs['metavar'] = a['metavar']
+    if not a['option_strings']:  # positional, dest is given as its name
+      del kwargs['dest']
+    action = parser.add_argument(
+        *(a['option_strings'] or [a['dest']]), **kwargs)
+    if a['refs']:
+      action.completer = argcomplete.completers.ChoicesCompleter(
+          [n for kind in a['refs'] for n in refs[kind]])
+  return parser
+
+
+# Private functions
+
+
+def _find_git_dir(path):
+  """Returns the git dir of the repo path is in or None."""
+  while True:
+    candidate = os.path.join(path, '.git')
+    if os.path.isdir(candidate):
+      return candidate
+    if os.path.isfile(candidate):  # worktrees and submodules
+      with open(candidate, 'r') as f:
+        line = f.readline().strip()
+      if line.startswith('gitdir:'):
+        return os.path.join(path, line[len('gitdir:'):].strip())
+      return None
+    parent = os.path.dirname(path)
+    if parent == path:
+      return None
+    path = parent
+
+
+def _stamp(git_dir, version):
+  # Refs are updated by renaming a lock file into place, so (unlike their
+  # contents) creating, deleting or updating a ref changes the mtime of the dir
+  # that contains it
+  common_dir = git_dir
+  try:
+    with open(os.path.join(git_dir, 'commondir'), 'r') as f:  # worktrees
+      common_dir = os.path.join(git_dir, f.readline().strip())
+  except IOError:
+    pass
+  paths = [
+      os.path.join(git_dir, 'index'), os.path.join(git_dir, 'HEAD'),
+      os.path.join(common_dir, 'packed-refs'),
+      os.path.join(common_dir, 'config')]
+  for dirpath, _, _ in os.walk(os.path.join(common_dir, 'refs')):
+    paths.append(dirpath)
+
+  stamp = [version]
+  for fp in paths:
+    try:
+      st = os.stat(fp)
+      stamp.append([os.path.relpath(fp, git_dir), st.st_mtime_ns, st.st_size])
+    except OSError:
+      stamp.append([os.path.relpath(fp, git_dir), None, None])
+  return stamp
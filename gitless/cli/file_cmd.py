@@ -18,7 +18,7 @@ def parser(help_msg, subcmd, subcmd_aliases=[]):
     p.add_argument(
         'files', nargs='+', help='the file(s) to {0}'.format(subcmd),
         action=helpers.PathProcessor, repo=repo,
-        skip_dir_test=repo and repo.current_branch.path_is_ignored,
+        skip_dir_test=_path_is_ignored(repo),
         skip_dir_cb=lambda path: pprint.warn(
           'Skipped files under directory {0} since they are all '
           'ignored'.format(path)))
@@ -26,6 +26,14 @@ def parser(help_msg, subcmd, subcmd_aliases=[]):
   return f
 
 
+def _path_is_ignored(repo):
+  # The repo is only looked at once there is a dir to test so that building
+  # the parser doesn't require opening the repo
+  def f(path):
+    return bool(repo) and repo.current_branch.path_is_ignored(path)
+  return f
+
+
 def main(subcmd):
   def f(args, repo):
     curr_b = repo.current_branch
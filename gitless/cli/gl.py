@@ -5,22 +5,20 @@
 """gl - Main Gitless's command. Dispatcher to the other cmds."""
 
 
+import os
 import sys
 import argparse
-import argcomplete
+import collections
+import importlib
 import traceback
-import pygit2
 
 from subprocess import CalledProcessError
 
-from gitless import core
+from gitless import trace
 
-from . import (
-    gl_track, gl_untrack, gl_status, gl_diff, gl_commit, gl_branch, gl_tag,
-    gl_checkout, gl_merge, gl_resolve, gl_fuse, gl_remote, gl_publish,
-    gl_switch, gl_init, gl_history)
-from . import pprint
-from . import helpers
+# gitless.core, pygit2 and the modules that depend on them (pprint, helpers and
+# the subcommands) are imported only when needed so that gl --version, gl help
+# and the like don't pay for loading them.
 
 
 SUCCESS = 0
@@ -31,54 +29,193 @@ NOT_IN_GL_REPO = 4
 
 __version__ = '0.8.8'
 URL = 'http://gitless.com'
+DESCRIPTION = (
+    'Gitless: a version control system built on top of Git.\nMore info, '
+    'downloads and documentation at {0}'.format(URL))
 
 
-repo = None
-try:
-  repo = core.Repository()
+class LazyRepository(object):
+  """The repository of the cwd, only discovered and opened on first use.
+
+  Attribute access is forwarded to the underlying core.Repository. A
+  LazyRepository evaluates to False if the cwd is not in a Gitless's
+  repository.
+
+  Args:
+    repo: an already opened core.Repository to use instead of looking for the
+      repository of the cwd (this is what gl daemon does).
+  """
+
+  def __init__(self, repo=None):
+    self._repo = repo
+    self._discovered = repo is not None
+    if repo:
+      _setup(repo)
+
+  def _open(self):
+    if not self._discovered:
+      from gitless import core
+      self._discovered = True
+      try:
+        self._repo = core.Repository()
+      except core.NotInRepoError:
+        pass
+      else:
+        _setup(self._repo)
+    return self._repo
+
+  def __bool__(self):
+    return self._open() is not None
+
+  def __getattr__(self, name):
+    repo = self._open()
+    if repo is None:
+      from gitless import core
+      raise core.NotInRepoError('You are not in a Gitless\'s repository')
+    return getattr(repo, name)
+
+
+def _setup(repo):
+  from . import gl_daemon
+  # If gl daemon is watching the repo it can tell us what changed
+  repo.fsmonitor = gl_daemon.changes_since
+  _setup_color(repo)
+
+
+def _setup_color(repo):
+  import pygit2
+  from . import pprint
   try:
-    pprint.DISABLE_COLOR = not repo.config.get_bool('color.ui')
-  except pygit2.GitError:
-    pprint.DISABLE_COLOR = (
-        repo.config['color.ui'] in ['no', 'never'])
-except (core.NotInRepoError, KeyError):
-  pass
+    try:
+      pprint.DISABLE_COLOR = not repo.config.get_bool('color.ui')
+    except pygit2.GitError:
+      pprint.DISABLE_COLOR = (
+          repo.config['color.ui'] in ['no', 'never'])
+  except KeyError:  # color.ui is not set
+    pass
+
+
+class SubCmd(collections.namedtuple(
+    'SubCmd', ['name', 'aliases', 'help', 'module', 'needs_repo'],
+    defaults=[True])):
+  """A gl subcommand whose module is only imported when its parser is built.
+
+  Attributes:
+    name: the name of the subcommand.
+    aliases: the short names the subcommand can also be invoked with.
+    help: the one-line description of the subcommand.
+    module: the name of the module (relative to this package) that
+      implements the subcommand.
+    needs_repo: whether the subcommand can only be run inside a repository
+      (True by default).
+  """
+
+  def load(self):
+    return importlib.import_module(self.module, __package__)
 
+  def parser(self, subparsers, repo):
+    self.load().parser(subparsers, repo)
 
-def print_help(parser):
+
+SUBCOMMANDS = [
+    SubCmd('track', ['tr'], 'start tracking changes to files', '.gl_track'),
+    SubCmd('untrack', ['un'], 'stop tracking changes to files', '.gl_untrack'),
+    SubCmd('status', ['st'], 'show status of the repo', '.gl_status'),
+    SubCmd('diff', ['df'], 'show changes to files', '.gl_diff'),
+    SubCmd(
+        'commit', ['ci'], 'save changes to the local repository', '.gl_commit'),
+    SubCmd(
+        'branch', ['br'], 'list, create, delete, or edit branches',
+        '.gl_branch'),
+    SubCmd('tag', ['tg'], 'list, create, or delete tags', '.gl_tag'),
+    SubCmd(
+        'checkout', ['co'], 'checkout committed versions of files',
+        '.gl_checkout'),
+    SubCmd(
+        'merge', ['mg'],
+        'merge the divergent changes of one branch onto another', '.gl_merge'),
+    SubCmd(
+        'resolve', ['rs'], 'mark files with conflicts as resolved',
+        '.gl_resolve'),
+    SubCmd(
+        'fuse', ['fs'],
+        'fuse the divergent changes of a branch onto the current branch',
+        '.gl_fuse'),
+    SubCmd(
+        'remote', ['rt'], 'list, create, edit or delete remotes', '.gl_remote'),
+    SubCmd('publish', ['pb'], 'publish commits upstream', '.gl_publish'),
+    SubCmd('switch', ['sw'], 'switch branches', '.gl_switch'),
+    SubCmd(
+        'init', ['in'], 'create an empty git repository or clone remote',
+        '.gl_init', needs_repo=False),
+    SubCmd('history', ['hs'], 'show commit history', '.gl_history'),
+    SubCmd(
+        'daemon', [],
+        'run a server that keeps repositories warm for other gl commands',
+        '.gl_daemon', needs_repo=False),
+    ]
+
+_SUBCOMMANDS_BY_NAME = dict(
+    (n, sub_cmd) for sub_cmd in SUBCOMMANDS
+    for n in [sub_cmd.name] + sub_cmd.aliases)
+
+
+def lookup_subcommand(argv):
+  """Returns the SubCmd the given command line invokes.
+
+  None is returned if argv is for the main command (e.g., gl --help) or if the
+  subcommand given doesn't exist.
+  """
+  for arg in argv:
+    if arg.startswith('-'):
+      return None
+    return _SUBCOMMANDS_BY_NAME.get(arg)
+  return None
+
+
+def print_help():
   """print help for humans"""
-  print(parser.description)
+  print(DESCRIPTION)
   print('\ncommands:\n')
+  for sub_cmd in SUBCOMMANDS:
+    print('    {:<19} {}'.format(sub_cmd.name, sub_cmd.help))
+
+def build_parser(subcommands, repo, stubs=False):
+  """Builds gl's parser.
 
-  # https://stackoverflow.com/questions/20094215/argparse-subparser-monolithic-help-output
-  # retrieve subparsers from parser
-  subparsers_actions = [
-      action for action in parser._actions
-      if isinstance(action, argparse._SubParsersAction)]
-  # there will probably only be one subparser_action,
-  # but better safe than sorry
-  for subparsers_action in subparsers_actions:
-      # get all subparsers and print help
-      for choice in subparsers_action._choices_actions:
-          print('    {:<19} {}'.format(choice.dest, choice.help))
-
-def build_parser(subcommands, repo):
+  Args:
+    subcommands: the subcommands to add to the parser.
+    repo: the repository, passed on to the subcommands' parsers.
+    stubs: if True, the subcommands are added with just their name, aliases
+      and help (taken from SUBCOMMANDS), which is all gl --help and argparse's
+      error messages need. Their modules are not imported.
+  """
+  # --trace is only recognized by main if it's given as is, so we don't let
+  # argparse take abbreviations of it (or of the other options)
   parser = argparse.ArgumentParser(
-      description=(
-          'Gitless: a version control system built on top of Git.\nMore info, '
-          'downloads and documentation at {0}'.format(URL)),
-      formatter_class=argparse.RawDescriptionHelpFormatter)
+      description=DESCRIPTION,
+      formatter_class=argparse.RawDescriptionHelpFormatter, allow_abbrev=False)
   if sys.version_info[0] < 3:
+      from . import helpers
       parser.register('action', 'parsers', helpers.AliasedSubParsersAction)
   parser.add_argument(
       '--version', action='version', version=(
          'GL Version: {0}\nYou can check if there\'s a new version of Gitless '
          'available at {1}'.format(__version__, URL)))
+  # --trace is handled by main before parsing, it's here for the help message
+  parser.add_argument(
+      '--trace', action='store_true',
+      help='log the git processes run and the time spent in them and in the '
+      'main libgit2 calls (same as setting GL_TRACE)')
   subparsers = parser.add_subparsers(title='subcommands', dest='subcmd_name')
   subparsers.required = True
 
   for sub_cmd in subcommands:
-    sub_cmd.parser(subparsers, repo)
+    if stubs:
+      subparsers.add_parser(
+          sub_cmd.name, help=sub_cmd.help, aliases=sub_cmd.aliases)
+    else:
+      sub_cmd.parser(subparsers, repo)
 
   return parser
 
@@ -89,24 +226,61 @@ def setup_windows_console():
     kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
 
 def main():
-  sub_cmds = [
-      gl_track, gl_untrack, gl_status, gl_diff, gl_commit, gl_branch, gl_tag,
-      gl_checkout, gl_merge, gl_resolve, gl_fuse, gl_remote, gl_publish,
-      gl_switch, gl_init, gl_history]
+  if sys.argv[1:2] == ['--trace']:
+    del sys.argv[1]
+    if not trace.enabled():
+      os.environ['GL_TRACE'] = '1'  # gl daemon gets it too
+
+  repo = LazyRepository()
+  if '_ARGCOMPLETE' in os.environ:
+    from . import completion
+    completion.autocomplete(
+        __version__, lambda: build_parser(SUBCOMMANDS, repo), repo)
 
-  parser = build_parser(sub_cmds, repo)
-  argcomplete.autocomplete(parser)
   if len(sys.argv) == 1:
-    print_help(parser)
+    print_help()
     return SUCCESS
 
-  args = parser.parse_args()
+  sub_cmd = lookup_subcommand(sys.argv[1:])
+  if sub_cmd and sub_cmd.name != 'daemon':
+    from . import gl_daemon
+    ret = gl_daemon.forward(sys.argv[1:])
+    if ret is not None:
+      return ret
+
+  return run(sys.argv[1:], repo)
+
+def run(argv, repo):
+  """Runs the gl command given by argv (without the program name) on repo.
+
+  Returns:
+    the exit code.
+  """
+  # Only the parser of the subcommand being run is built (and only its module
+  # imported), the full parser is needed just for completion
+  sub_cmd = lookup_subcommand(argv)
+  if sub_cmd:
+    parser = build_parser([sub_cmd], repo)
+  else:
+    parser = build_parser(SUBCOMMANDS, repo, stubs=True)
+
+  args = parser.parse_args(argv)
+  if not sub_cmd:
+    # The subcommand came after an option (e.g., gl --trace --trace status),
+    # the stubs can parse that but they can't run it
+    sub_cmd = _SUBCOMMANDS_BY_NAME[args.subcmd_name]
+    args = build_parser([sub_cmd], repo).parse_args(argv)
+
+  import pygit2
+  from gitless import core
+  from . import pprint
   try:
-    if args.subcmd_name != 'init' and not repo:
+    if sub_cmd.needs_repo and not repo:
       raise core.NotInRepoError('You are not in a Gitless\'s repository')
 
     setup_windows_console()
-    return SUCCESS if args.func(args, repo) else ERRORS_FOUND
+    with trace.span('gl ' + sub_cmd.name):
+      return SUCCESS if args.func(args, repo) else ERRORS_FOUND
   except KeyboardInterrupt:
     pprint.puts('\n')
     pprint.msg('Keyboard interrupt detected, operation aborted')
@@ -129,3 +303,5 @@ def main():
         'include the following information:\n\n{1}\n\n{2}'.format(
             URL, __version__, traceback.format_exc()))
     return INTERNAL_ERROR
+  finally:
+    trace.summary()
@@ -7,10 +7,10 @@
 
 from gitless import core
 
-from . import helpers, pprint
+from . import completion, helpers, pprint
 
 
-def parser(subparsers, _):
+def parser(subparsers, repo):
   """Adds the branch parser to the given subparsers object."""
   desc = 'list, create, delete, or edit branches'
   branch_parser = subparsers.add_parser(
@@ -37,7 +37,8 @@ def parser(subparsers, _):
   delete_group = branch_parser.add_argument_group('delete branches')
   delete_group.add_argument(
       '-d', '--delete', nargs='+', help='delete branch(es)', dest='delete_b',
-      metavar='branch')
+      metavar='branch').completer = completion.RefCompleter(
+          repo, completion.BRANCH)
 
   edit_current_branch_group = branch_parser.add_argument_group('edit the current branch')
   edit_current_branch_group.add_argument(
@@ -46,7 +47,8 @@ def parser(subparsers, _):
   edit_current_branch_group.add_argument(
       '-su', '--set-upstream',
       help='set the upstream branch of the current branch',
-      dest='upstream_b', metavar='branch')
+      dest='upstream_b', metavar='branch').completer = completion.RefCompleter(
+          repo, completion.REMOTE_BRANCH)
   edit_current_branch_group.add_argument(
       '-uu', '--unset-upstream',
       help='unset the upstream branch of the current branch',
@@ -58,7 +60,7 @@ def parser(subparsers, _):
       help='renames the current branch (gl branch -rn new_name) '
       'or another specified branch (gl branch -rn branch_name new_name)',
       dest='rename_b'
-  )
+  ).completer = completion.RefCompleter(repo, completion.BRANCH)
 
   branch_parser.set_defaults(func=main)
 
@@ -7,7 +7,7 @@
 
 from gitless import core
 
-from . import helpers, pprint
+from . import completion, helpers, pprint
 
 
 def parser(subparsers, repo):
@@ -18,7 +18,8 @@ def parser(subparsers, repo):
   checkout_parser.add_argument(
       '-cp', '--commit-point', help=(
           'the commit point to checkout the files at. Defaults to HEAD.'),
-      dest='cp', default='HEAD')
+      dest='cp', default='HEAD').completer = completion.RefCompleter(
+          repo, completion.BRANCH, completion.REMOTE_BRANCH, completion.TAG)
   checkout_parser.add_argument(
       'files', nargs='+', help='the file(s) to checkout',
       action=helpers.PathProcessor, repo=repo, recursive=False)
@@ -30,13 +31,15 @@ def main(args, repo):
 
   curr_b = repo.current_branch
   cp = args.cp
+  files = list(args.files)
+  statuses = curr_b.status_files(files)
 
-  for fp in args.files:
+  for fp in files:
     conf_msg = (
         'You have uncomitted changes in "{0}" that could be overwritten by '
         'checkout'.format(fp))
     try:
-      f = curr_b.status_file(fp)
+      f = statuses[fp]
       if f.type == core.GL_STATUS_TRACKED and f.modified and (
           not pprint.conf_dialog(conf_msg)):
         pprint.err('Checkout aborted')
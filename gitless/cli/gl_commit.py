@@ -41,13 +41,13 @@ def main(args, repo):
   curr_b = repo.current_branch
   total_additions = 0
   total_deletions = 0
-  for fp in commit_files:
-      try:
-        patch = curr_b.diff_file(fp)
-      except KeyError:
+  for fp, patch in curr_b.diff_files(commit_files):
+      if patch is None:
         continue
 
-      if patch.delta.is_binary:
+      # (files that are too large or binary are not diffed)
+      if (isinstance(patch, core.Branch.SkippedDiff) or
+          patch.delta.is_binary):
         continue
 
       total_additions += patch.line_stats[1]
@@ -101,8 +101,9 @@ def _author_info_is_ok(repo):
 
 def _do_partial_selection(files, curr_b):
   partials = []
+  statuses = curr_b.status_files(files)
   for fp in files:
-    f_st = curr_b.status_file(fp)
+    f_st = statuses[fp]
     if not f_st.exists_at_head:
       pprint.warn('Can\'t select segments for new file {0}'.format(fp))
       continue
@@ -119,8 +120,9 @@ def _do_partial_selection(files, curr_b):
 
 def _auto_track(files, curr_b):
   """Tracks those untracked files in the list."""
+  statuses = curr_b.status_files(files)
   for fp in files:
-    f = curr_b.status_file(fp)
+    f = statuses[fp]
     if f.type == core.GL_STATUS_UNTRACKED:
       curr_b.track_file(f.fp)
 
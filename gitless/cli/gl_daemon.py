@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""gl daemon - Keep repositories warm to speed up other gl commands.
+
+The daemon listens on a Unix socket. When it's running, gl forwards the
+command line it was invoked with, along with its cwd, environment and
+stdin/stdout/stderr, to the daemon, which forks a child to run the command.
+The child inherits an already opened repository (and the Python modules
+already imported) so the command doesn't pay for any of that. Since the
+child gets gl's own file descriptors, output goes straight to gl's
+stdout/stderr (and pagers, editors and prompts work as usual).
+
+With --watch, the daemon also watches the working directory of the
+repositories commands are run on (see gitless.watcher) and tells gl which
+paths changed since it last looked so that status doesn't have to look at
+everything (see changes_since).
+
+gl imports this module on every invocation to look for a running daemon, so
+at import time it only depends on the standard library.
+"""
+
+
+import json
+import os
+import select
+import signal
+import socket
+import stat
+import struct
+import sys
+
+
+# Number of seconds to wait for a client to send its request
+_REQUEST_TIMEOUT = 5
+
+_HEADER = struct.Struct('!I')
+
+
+def parser(subparsers, _):
+  """Adds the daemon parser to the given subparsers object."""
+  desc = 'run a server that keeps repositories warm for other gl commands'
+  daemon_parser = subparsers.add_parser(
+      'daemon', help=desc, description=(
+        desc.capitalize() + '. ' +
+        'While the daemon is running gl commands are forwarded to it. Set '
+        'GL_NO_DAEMON to skip the daemon'))
+  daemon_parser.add_argument(
+      '-f', '--foreground', help='don\'t detach from the terminal',
+      action='store_true')
+  daemon_parser.add_argument(
+      '-s', '--stop', help='stop the running daemon', action='store_true')
+  daemon_parser.add_argument(
+      '-w', '--watch', help=(
+          'watch the working directory of repositories for changes so that '
+          'gl status only needs to look at what changed (Linux only)'),
+      action='store_true')
+  daemon_parser.set_defaults(func=main)
+
+
+def main(args, _):
+  from . import pprint
+
+  if not _is_supported():
+    pprint.err('gl daemon is not supported on this platform')
+    return False
+
+  path = socket_path(create=True)
+  if not path:
+    pprint.err(
+        '{0} is not a directory only you have access to, remove it or set '
+        'GL_DAEMON_SOCKET to where to put the socket'.format(
+            _tmp_sock_dir()))
+    return False
+  if args.stop:
+    if _send(path, {'stop': True}) is None:
+      pprint.err('No daemon is running')
+      return False
+    pprint.ok('Daemon stopped')
+    return True
+
+  if _send(path, {'ping': True}) is not None:
+    pprint.err('A daemon is already running')
+    return False
+
+  from gitless import watcher
+  if args.watch and not watcher.is_supported():
+    pprint.err('Watching for changes is not supported on this platform')
+    return False
+
+  if os.path.exists(path):  # stale socket of a daemon that died
+    os.remove(path)
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  sock.bind(path)
+  sock.listen(socket.SOMAXCONN)
+
+  if not args.foreground:
+    pprint.ok('Daemon started, listening on {0}'.format(path))
+    sys.stdout.flush()
+    if os.fork():
+      return True
+    _detach()
+
+  try:
+    _serve(sock, args.watch)
+  finally:
+    sock.close()
+    if os.path.exists(path):
+      os.remove(path)
+  return True
+
+
+def socket_path(create=False):
+  """Returns the path to the daemon's socket for the current user.
+
+  None is returned if the socket would be in a directory someone else could
+  have put their own socket in (or that doesn't exist).
+
+  Args:
+    create: if True, the directory of the socket is created if it doesn't
+      exist (only the daemon needs to).
+  """
+  path = os.environ.get('GL_DAEMON_SOCKET')
+  if path:
+    return path
+  runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+  if runtime_dir:
+    return os.path.join(runtime_dir, 'gl-daemon.sock')
+  # /tmp is shared, so we use a directory only the current user has access to.
+  # Another user could have created it first, so we check who owns it
+  sock_dir = _tmp_sock_dir()
+  if create:
+    try:
+      os.mkdir(sock_dir, 0o700)
+    except FileExistsError:
+      pass
+    except OSError:
+      return None
+  try:
+    st = os.lstat(sock_dir)
+  except OSError:
+    return None
+  if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+      stat.S_IMODE(st.st_mode) != 0o700):
+    return None
+  return os.path.join(sock_dir, 'sock')
+
+
+def forward(argv):
+  """Runs the gl command given by argv on the daemon.
+
+  Returns:
+    the exit code of the command or None if there's no daemon running (in
+    which case the command should be run by the caller).
+  """
+  if os.environ.get('GL_NO_DAEMON') or not _is_supported():
+    return None
+  path = socket_path()
+  if not path or not os.path.exists(path):
+    return None
+
+  conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    conn.connect(path)
+  except OSError:
+    conn.close()
+    return None
+  # We are about to hand over our environment and file descriptors
+  if not _same_user(conn):
+    conn.close()
+    return None
+
+  with conn:
+    body = json.dumps(
+        {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}).encode()
+    socket.send_fds(conn, [_HEADER.pack(len(body))], [0, 1, 2])
+    conn.sendall(body)
+
+    # Ctrl-C goes to gl and not to the daemon's child (which isn't attached to
+    # our terminal) so we pass it along
+    child_pid = None
+    def forward_sigint(signum, frame):
+      if child_pid:
+        os.kill(child_pid, signum)
+    prev_handler = signal.signal(signal.SIGINT, forward_sigint)
+    try:
+      for line in conn.makefile('r'):
+        msg = json.loads(line)
+        if 'pid' in msg:
+          child_pid = msg['pid']
+        elif 'exit' in msg:
+          return msg['exit']
+    finally:
+      signal.signal(signal.SIGINT, prev_handler)
+
+  # The child died without telling us how the command went
+  from . import gl
+  return gl.INTERNAL_ERROR
+
+
+def changes_since(root, token):
+  """Asks the daemon for the paths that changed under root since token.
+
+  This is the fsmonitor gl sets for the repositories it opens (see
+  core.Repository).
+
+  Returns:
+    a new token and the paths (relative to root) that changed since token, or
+    None as the paths if they are not known (e.g., there's no daemon watching
+    for changes).
+  """
+  if os.environ.get('GL_NO_DAEMON') or not _is_supported():
+    return None, None
+  reply = _send(socket_path(), {'changes': root, 'token': token})
+  if not reply:
+    return None, None
+  return reply['token'], reply['paths']
+
+
+# Private functions
+
+
+def _is_supported():
+  return hasattr(socket, 'send_fds') and hasattr(os, 'fork')
+
+
+def _send(path, msg):
+  """Sends a control msg to the daemon.
+
+  Returns:
+    the daemon's reply ({} if it doesn't reply anything) or None if there's no
+    daemon.
+  """
+  if not path:
+    return None
+  conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    conn.connect(path)
+  except OSError:
+    conn.close()
+    return None
+  with conn:
+    if not _same_user(conn):
+      return None
+    body = json.dumps(msg).encode()
+    try:
+      conn.sendall(_HEADER.pack(len(body)) + body)
+      # The daemon closes the connection once it's done
+      reply = conn.makefile('r').read()
+    except OSError:
+      return None
+  return json.loads(reply) if reply else {}
+
+
+def _tmp_sock_dir():
+  """Returns where the socket goes if there's no XDG_RUNTIME_DIR."""
+  return os.path.join(
+      os.environ.get('TMPDIR', '/tmp'), 'gl-daemon-{0}'.format(os.getuid()))
+
+
+def _same_user(conn):
+  """Returns True if the process at the other end of the Unix socket conn
+  runs as the current user (or if we can't tell on this platform)."""
+  if not hasattr(socket, 'SO_PEERCRED'):
+    return True
+  creds = conn.getsockopt(
+      socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+  _, uid, _ = struct.unpack('3i', creds)
+  return uid == os.getuid()
+
+
+def _detach():
+  os.setsid()
+  devnull = os.open(os.devnull, os.O_RDWR)
+  for fd in (0, 1, 2):
+    os.dup2(devnull, fd)
+  os.close(devnull)
+
+
+def _serve(sock, watch):
+  import pygit2
+  from gitless import core
+  from . import gl
+
+  # Import every subcommand upfront so that children don't have to
+  for sub_cmd in gl.SUBCOMMANDS:
+    sub_cmd.load()
+
+  # We never wait for children, this way the kernel reaps them for us
+  signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+  repos = {}
+  # root -> Watcher (or None if the root can't be watched)
+  watchers = {}
+  while True:
+    # We read the events of watchers as they come so that the kernel's queue
+    # doesn't overflow
+    ready, _, _ = select.select(
+        [sock] + [w for w in watchers.values() if w], [], [])
+    for w in ready:
+      if w is not sock:
+        w.read_events()
+    if sock not in ready:
+      continue
+
+    conn, _ = sock.accept()
+    if not _same_user(conn):
+      conn.close()
+      continue
+    try:
+      conn.settimeout(_REQUEST_TIMEOUT)
+      request, fds = _recv_request(conn)
+    except (OSError, ValueError):
+      conn.close()
+      continue
+
+    if 'cwd' not in request:  # control msg
+      if 'changes' in request:
+        reply = {'token': None, 'paths': None}
+        if watch:
+          w = _watcher(watchers, request['changes'])
+          if w:
+            reply['token'], reply['paths'] = w.changes_since(request['token'])
+        try:
+          conn.sendall(json.dumps(reply).encode())
+        except OSError:
+          pass
+      conn.close()
+      if request.get('stop'):
+        return
+      continue
+
+    try:
+      repo = _warm_repo(repos, request['cwd'])
+    except (OSError, pygit2.GitError, core.GlError):
+      repo = None
+
+    if not os.fork():
+      sock.close()
+      _run(conn, request, fds, repo)  # doesn't return
+    conn.close()
+    for fd in fds:
+      os.close(fd)
+
+
+def _recv_request(conn):
+  msg, fds, _, _ = socket.recv_fds(conn, _HEADER.size, 3)
+  if len(msg) != _HEADER.size:
+    raise ValueError('Malformed request')
+  size, = _HEADER.unpack(msg)
+  body = b''
+  while len(body) < size:
+    chunk = conn.recv(size - len(body))
+    if not chunk:
+      raise ValueError('Malformed request')
+    body += chunk
+  return json.loads(body.decode()), fds
+
+
+def _warm_repo(repos, cwd):
+  """Returns the (opened) repository cwd is in or None.
+
+  Repositories are cached and reopened if their index, refs or config change.
+  """
+  import pygit2
+  from gitless import core
+
+  path = pygit2.discover_repository(cwd)
+  if not path:
+    return None
+
+  stamp = _repo_stamp(path)
+  if path in repos and repos[path][0] == stamp:
+    return repos[path][1]
+
+  os.chdir(cwd)  # Repository looks for the repo in the cwd
+  repo = core.Repository()
+  # Load the index, refs and ignore rules now so that children get them
+  repo.git_repo.index
+  repo.current_branch.path_is_ignored('.')
+  repos[path] = (stamp, repo)
+  return repo
+
+
+def _watcher(watchers, root):
+  from gitless import watcher
+
+  w = watchers.get(root)
+  if w and not w.alive:  # e.g., the repo was moved
+    w.close()
+    del watchers[root]
+  if root not in watchers:
+    try:
+      watchers[root] = watcher.Watcher(root)
+    except OSError:  # e.g., we ran out of inotify watches
+      watchers[root] = None
+  return watchers[root]
+
+
+def _repo_stamp(path):
+  stamp = []
+  for fp in ('index', 'HEAD', 'packed-refs', 'config', 'refs/heads'):
+    try:
+      st = os.stat(os.path.join(path, fp))
+      stamp.append((st.st_mtime_ns, st.st_size))
+    except OSError:
+      stamp.append(None)
+  return stamp
+
+
+def _run(conn, request, fds, repo):
+  """Runs the requested command in a child of the daemon and exits."""
+  from . import gl
+
+  code = gl.INTERNAL_ERROR
+  try:
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    conn.settimeout(None)
+    for i, fd in enumerate(fds):
+      os.dup2(fd, i)
+      os.close(fd)
+    sys.stdout.reconfigure(line_buffering=sys.stdout.isatty())
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    sys.argv = ['gl'] + request['argv']
+    conn.sendall((json.dumps({'pid': os.getpid()}) + '\n').encode())
+
+    try:
+      code = gl.run(request['argv'], gl.LazyRepository(repo=repo))
+    except SystemExit as e:  # argparse exits on errors and help
+      code = e.code if isinstance(e.code, int) else bool(e.code)
+  finally:
+    try:
+      sys.stdout.flush()
+      sys.stderr.flush()
+      conn.sendall((json.dumps({'exit': code}) + '\n').encode())
+    finally:
+      os._exit(code)
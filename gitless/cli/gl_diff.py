@@ -5,10 +5,28 @@
 """gl diff - Show changes in files."""
 
 
+import collections
+import io
+import itertools
+import multiprocessing
 import os
-import tempfile
 
-from . import helpers, pprint
+import pygit2
+
+from gitless import core
+
+from . import completion, helpers, pprint
+
+
+# With fewer files than this gl diff doesn't bother to use more processes
+PARALLEL_MIN_FILES = 200
+# The max number of files each process diffs at a time
+CHUNK_SIZE = 50
+# The max number of changed lines of the files each process renders at a time
+# (the output of the chunks being worked on is held in memory)
+CHUNK_LINES = 10000
+# The width of the lines of --stat (if the paths are not too long)
+STAT_WIDTH = 80
 
 
 def parser(subparsers, repo):
@@ -20,47 +38,283 @@ def parser(subparsers, repo):
         'By default all tracked modified files are diffed. To customize the '
         ' set of files to diff use the only, exclude, and include flags'), aliases=['df'])
   helpers.oei_flags(diff_parser, repo)
+  diff_parser.add_argument(
+      '-cp', '--commit-point', help=(
+          'the commit point to diff the files against (instead of HEAD). Use '
+          'cp1..cp2 to diff commit point cp1 against cp2 (instead of against '
+          'the working directory)'),
+      dest='cp').completer = completion.RefCompleter(
+          repo, completion.BRANCH, completion.REMOTE_BRANCH, completion.TAG)
+  diff_parser.add_argument(
+      '--find-renames', action='store_true', help=(
+          'detect renamed files (only with --commit-point). The max number of '
+          'files to consider is given by the diff.renameLimit config option '
+          '(1000 by default)'))
+  diff_parser.add_argument(
+      '-j', '--jobs', type=int, default=0, help=(
+          'the number of processes to use to generate (and render) the diffs. '
+          'By default there is one per CPU if there are many files to diff'))
+  summary_group = diff_parser.add_mutually_exclusive_group()
+  summary_group.add_argument(
+      '--stat', action='store_true', help=(
+          'instead of the diffs, show the number of changed lines of each file '
+          '(and a graph of the lines added and removed)'))
+  summary_group.add_argument(
+      '--numstat', action='store_true', help=(
+          'instead of the diffs, show the number of lines added and removed of '
+          'each file (or - for binary files), separated by tabs'))
+  summary_group.add_argument(
+      '--name-only', action='store_true', help=(
+          'instead of the diffs, show only the paths of the changed files'))
   diff_parser.set_defaults(func=main)
 
 
 def main(args, repo):
-  files = helpers.oei_fs(args, repo)
-  if not files:
-    pprint.warn('No files to diff')
+  summary = args.stat or args.numstat or args.name_only
+  if args.cp:
+    diff = _cp_diff(args, repo)
+    if not len(diff) and not summary:
+      pprint.warn('No files to diff')
+    positions = {}
 
-  success = True
-  curr_b = repo.current_branch
-  with tempfile.NamedTemporaryFile(mode='w', delete=False) as tf:
-    total_additions = 0
-    total_deletions = 0
-    patches = []
-    for fp in files:
-      try:
-        patch = curr_b.diff_file(fp)
-      except KeyError:
-        pprint.err('Can\'t diff non-existent file {0}'.format(fp))
-        success = False
-        continue
-
-      if patch.delta.is_binary:
-        pprint.warn('Not showing diffs for binary file {0}'.format(fp))
-        continue
+    def cp_stats():
+      # The patches are built as they are needed (and not held on to)
+      for i, patch in enumerate(diff):
+        fp = _patch_fp(patch)
+        positions[fp] = i
+        yield _stats(fp, patch)
+
+    stats = cp_stats()
+    render = lambda fps, lines: (
+        _render(fp, diff[positions[fp]]) for fp in fps)
+  else:
+    if args.find_renames:
+      raise ValueError('--find-renames can only be used with --commit-point')
+    files = helpers.oei_fs(args, repo)
+    if not files and not summary:
+      pprint.warn('No files to diff')
+    stats = _map(_stats, _chunks(files), args.jobs, repo)
+    render = lambda fps, lines: _map(
+        _render, _chunks(fps, lines), args.jobs, repo)
 
-      additions = patch.line_stats[1]
-      deletions = patch.line_stats[2]
-      total_additions += additions
-      total_deletions += deletions
-      if (not additions) and (not deletions):
+  success = True
+  changed = []  # the stats (see _stats) of the changed files
+  # To be able to show the totals first without holding on to all the diffs,
+  # we go over the files twice: first to get their stats and then to render
+  # and output their diffs, one at a time
+  for fp, kind, additions, deletions, sizes in stats:
+    if kind == _NONEXISTENT:
+      pprint.err('Can\'t diff non-existent file {0}'.format(fp))
+      success = False
+    elif kind == _NO_DIFFS:
+      if not summary:
         pprint.warn('No diffs to output for {0}'.format(fp))
-        continue
-      patches.append(patch)
-    if patches:
-      pprint.diff_totals(total_additions, total_deletions, stream=tf.write)
-      for patch in patches:
-        pprint.diff(patch, stream=tf.write)
+    else:
+      if kind == _BINARY and not summary:
+        pprint.warn('Not showing diffs for binary file {0}'.format(fp))
+      elif kind == _LARGE and not summary:
+        pprint.warn('Not showing diffs for large file {0} ({1})'.format(
+            fp, _sizes_str(sizes)))
+      changed.append((fp, kind, additions, deletions, sizes))
 
-  if os.path.getsize(tf.name) > 0:
-    helpers.page(tf.name, repo)
-  os.remove(tf.name)
+  with helpers.pager(repo) as stream:
+    if args.name_only:
+      for fp, _, _, _, _ in changed:
+        pprint.puts(fp, stream=stream)
+    elif args.numstat:
+      for fp, kind, additions, deletions, _ in changed:
+        if kind in (_BINARY, _LARGE):
+          pprint.puts('-\t-\t{0}'.format(fp), stream=stream)
+        else:
+          pprint.puts(
+              '{0}\t{1}\t{2}'.format(additions, deletions, fp), stream=stream)
+    elif args.stat:
+      _print_stat(changed, stream)
+    else:
+      to_render = [c for c in changed if c[1] == _DIFFS]
+      if to_render:
+        pprint.diff_totals(
+            sum(c[2] for c in to_render), sum(c[3] for c in to_render),
+            stream=stream)
+        for out in render(
+            [c[0] for c in to_render], [c[2] + c[3] for c in to_render]):
+          stream(out)
 
   return success
+
+
+def _cp_diff(args, repo):
+  """Returns the diff of the commit point(s) given by args.cp."""
+  if args.exclude or args.include:
+    raise ValueError('-e and -i can\'t be used with --commit-point')
+  paths = list(args.only or []) or None
+  curr_b = repo.current_branch
+  if '..' in args.cp:
+    cp1, cp2 = args.cp.split('..', 1)
+    return curr_b.diff_commits(
+        _commit(cp1, repo), _commit(cp2, repo), paths=paths,
+        find_renames=args.find_renames)
+  return curr_b.diff_wd(
+      _commit(args.cp, repo), paths=paths, find_renames=args.find_renames)
+
+
+def _commit(cp, repo):
+  # Like git, an empty commit point means HEAD (e.g., in cp..)
+  return repo.revparse_single(cp or 'HEAD').peel(pygit2.Commit)
+
+
+def _patch_fp(patch):
+  old_fp = patch.delta.old_file.path
+  new_fp = patch.delta.new_file.path
+  return old_fp if old_fp == new_fp else '{0} => {1}'.format(old_fp, new_fp)
+
+
+def _print_stat(changed, stream):
+  """Prints a line per file with its number of changed lines and a graph."""
+  if not changed:
+    return
+  fp_width = max(len(c[0]) for c in changed)
+  max_lines = max(c[2] + c[3] for c in changed)
+  count_width = len(str(max_lines))
+  if any(c[1] in (_BINARY, _LARGE) for c in changed):
+    count_width = max(count_width, len('Bin'))
+  graph_width = max(STAT_WIDTH - fp_width - count_width - 4, 10)
+  for fp, kind, additions, deletions, sizes in changed:
+    if kind in (_BINARY, _LARGE):
+      line = ' {0} | {1}'.format(fp.ljust(fp_width), 'Bin'.rjust(count_width))
+      if sizes:
+        line += ' ' + _sizes_str(sizes)
+      pprint.puts(line, stream=stream)
+      continue
+    lines = additions + deletions
+    plus, minus = additions, deletions
+    if max_lines > graph_width:  # scale the graph down
+      plus = _scale(additions, max_lines, graph_width)
+      minus = _scale(deletions, max_lines, graph_width)
+    pprint.puts(' {0} | {1} {2}{3}'.format(
+        fp.ljust(fp_width), str(lines).rjust(count_width),
+        pprint.green('+' * plus) if plus else '',
+        pprint.red('-' * minus) if minus else ''), stream=stream)
+
+  total_additions = sum(c[2] for c in changed)
+  total_deletions = sum(c[3] for c in changed)
+  put_s = lambda num: '' if num == 1 else 's'
+  pprint.puts(
+      ' {0} file{1} changed, {2} insertion{3}(+), {4} deletion{5}(-)'.format(
+          len(changed), put_s(len(changed)), total_additions,
+          put_s(total_additions), total_deletions, put_s(total_deletions)),
+      stream=stream)
+
+
+def _scale(n, max_n, width):
+  # Any change gets at least one char
+  return max(n * width // max_n, 1) if n else 0
+
+
+_NONEXISTENT, _BINARY, _LARGE, _NO_DIFFS, _DIFFS = range(5)
+
+
+def _chunks(files, lines=None):
+  """Splits files into chunks of up to CHUNK_SIZE files.
+
+  If lines (the number of changed lines of each file) is given, chunks also
+  have up to CHUNK_LINES changed lines (unless they have a single file).
+  """
+  chunk = []
+  chunk_lines = 0
+  for i, fp in enumerate(files):
+    fp_lines = lines[i] if lines else 0
+    if chunk and (
+        len(chunk) == CHUNK_SIZE or chunk_lines + fp_lines > CHUNK_LINES):
+      yield chunk
+      chunk = []
+      chunk_lines = 0
+    chunk.append(fp)
+    chunk_lines += fp_lines
+  if chunk:
+    yield chunk
+
+
+def _map(fn, chunks, jobs, repo):
+  """Diffs the files in chunks and applies fn(fp, patch) to each of them.
+
+  If there are many files, the work is split among a pool of processes (each
+  diffs a chunk of files at a time). Either way, the results come in the order
+  of the files, and only a few chunks are worked on ahead of the one whose
+  results are being consumed.
+
+  Returns:
+    a generator of the results of fn.
+  """
+  chunks = list(chunks)
+  if jobs <= 0:
+    files_count = sum(len(chunk) for chunk in chunks)
+    jobs = (os.cpu_count() or 1) if files_count >= PARALLEL_MIN_FILES else 1
+  # The processes inherit the state of this one (e.g., whether to color)
+  if (jobs > 1 and len(chunks) > 1 and
+      'fork' in multiprocessing.get_all_start_methods()):
+    jobs = min(jobs, len(chunks))
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(jobs) as pool:
+      # Unlike with imap, the results that are not consumed yet don't pile up
+      pending = collections.deque()
+      for chunk in chunks:
+        pending.append(pool.apply_async(_diff_chunk, (fn, chunk)))
+        if len(pending) > 2 * jobs:
+          yield from pending.popleft().get()
+      while pending:
+        yield from pending.popleft().get()
+    return
+
+  curr_b = repo.current_branch
+  for fp, patch in curr_b.diff_files(itertools.chain.from_iterable(chunks)):
+    yield fn(fp, patch)
+
+
+def _diff_chunk(fn, files):
+  # Each process opens the repo (of the cwd) once
+  global _worker_repo
+  if _worker_repo is None:
+    _worker_repo = core.Repository()
+  curr_b = _worker_repo.current_branch
+  return [fn(fp, patch) for fp, patch in curr_b.diff_files(files)]
+
+_worker_repo = None
+
+
+def _stats(fp, patch):
+  """Returns the (fp, kind, additions, deletions, sizes) of the diff of fp.
+
+  sizes is the (old, new) sizes of the file if it was not diffed (see
+  core.Branch.diff_files), None otherwise.
+  """
+  if patch is None:
+    return fp, _NONEXISTENT, 0, 0, None
+  if isinstance(patch, core.Branch.SkippedDiff):
+    return (
+        fp, _LARGE if patch.large else _BINARY, 0, 0,
+        (patch.old_size, patch.new_size))
+  if patch.delta.status == pygit2.GIT_DELTA_UNMODIFIED:
+    return fp, _NO_DIFFS, 0, 0, None
+  if patch.delta.is_binary:
+    return fp, _BINARY, 0, 0, None
+  _, additions, deletions = patch.line_stats
+  if ((not additions) and (not deletions) and
+      patch.delta.status != pygit2.GIT_DELTA_RENAMED):
+    return fp, _NO_DIFFS, 0, 0, None
+  return fp, _DIFFS, additions, deletions, None
+
+
+def _sizes_str(sizes):
+  old_size, new_size = sizes
+  return '{0} -> {1} bytes'.format(old_size or 0, new_size or 0)
+
+
+def _render(fp, patch):
+  """Returns the diff of fp as it's output."""
+  # The file could have changed since we got its stats
+  if _stats(fp, patch)[1] != _DIFFS:
+    return ''
+  out = io.StringIO()
+  pprint.diff(patch, stream=out.write)
+  return out.getvalue()
@@ -7,7 +7,7 @@
 
 from gitless import core
 
-from . import helpers, pprint
+from . import completion, helpers, pprint
 
 
 def parser(subparsers, repo):
@@ -22,7 +22,9 @@ def parser(subparsers, repo):
       'src', nargs='?',
       help=(
         'the source branch to read changes from. If none is given the upstream '
-        'branch of the current branch is used as the source'))
+        'branch of the current branch is used as the source')
+      ).completer = completion.RefCompleter(
+          repo, completion.BRANCH, completion.REMOTE_BRANCH)
   fuse_parser.add_argument(
       '-o', '--only', nargs='+',
       help=(
@@ -5,13 +5,10 @@
 """gl history - Show commit history."""
 
 
-import os
-import tempfile
+from . import completion, helpers, pprint
 
-from . import helpers, pprint
 
-
-def parser(subparsers, _):
+def parser(subparsers, repo):
   """Adds the history parser to the given subparsers object."""
   desc = 'show commit history'
   history_parser = subparsers.add_parser(
@@ -26,25 +23,27 @@ def parser(subparsers, _):
       action='store_true', default=False)
   history_parser.add_argument(
       '-b', '--branch', nargs='?', metavar='branch_name', dest='b',
-      help='the branch to show history of (defaults to the current branch)')
+      help='the branch to show history of (defaults to the current branch)'
+      ).completer = completion.RefCompleter(
+          repo, completion.BRANCH, completion.REMOTE_BRANCH)
   history_parser.set_defaults(func=main)
 
 
 def main(args, repo):
   b = helpers.get_branch(args.b, repo) if args.b else repo.current_branch
-  with tempfile.NamedTemporaryFile(mode='w', delete=False) as tf:
+  with helpers.pager(repo) as stream:
     count = 0
-    for ci in b.history():
+    # A topological (or date) sort would have to walk the whole history before
+    # we could show the first commit
+    for ci in b.history(topological=False):
       if args.limit and count == args.limit:
         break
-      pprint.commit(ci, compact=args.compact, stream=tf.write)
+      pprint.commit(ci, compact=args.compact, stream=stream)
       if not args.compact:
-        pprint.puts(stream=tf.write)
+        pprint.puts(stream=stream)
       if args.verbose and len(ci.parents) == 1:
         for patch in b.diff_commits(ci.parents[0], ci):
-          pprint.diff(patch, stream=tf.write)
+          pprint.diff(patch, stream=stream)
 
       count += 1
-  helpers.page(tf.name, repo)
-  os.remove(tf.name)
   return True
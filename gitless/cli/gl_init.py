@@ -33,10 +33,9 @@ def parser(subparsers, _):
   init_parser.set_defaults(func=main)
 
 
-def main(args, repo):
-  if repo:
-    pprint.err('You are already in a Gitless repository')
-    return False
+def main(args, _):
+  # No need to check whether we are in a repo already, init_repository fails if
+  # that's the case (and we save ourselves from discovering the repo twice)
   core.init_repository(url=args.repo,
         only=frozenset(args.only if args.only else []),
         exclude=frozenset(args.exclude if args.exclude else []))
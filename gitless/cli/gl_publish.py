@@ -5,16 +5,18 @@
 """gl publish - Publish commits upstream."""
 
 
-from . import helpers, pprint
+from . import completion, helpers, pprint
 
 
-def parser(subparsers, _):
+def parser(subparsers, repo):
   """Adds the publish parser to the given subparsers object."""
   desc = 'publish commits upstream'
   publish_parser = subparsers.add_parser(
       'publish', help=desc, description=desc.capitalize(), aliases=['pb'])
   publish_parser.add_argument(
-      'dst', nargs='?', help='the branch where to publish commits')
+      'dst', nargs='?', help='the branch where to publish commits'
+      ).completer = completion.RefCompleter(
+          repo, completion.BRANCH, completion.REMOTE_BRANCH)
   publish_parser.set_defaults(func=main)
 
 
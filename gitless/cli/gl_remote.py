@@ -5,10 +5,10 @@
 """gl remote - List, create, edit or delete remotes."""
 
 
-from . import pprint
+from . import completion, pprint
 
 
-def parser(subparsers, _):
+def parser(subparsers, repo):
   """Adds the remote parser to the given subparsers object."""
   desc = 'list, create, edit or delete remotes'
   remote_parser = subparsers.add_parser(
@@ -21,12 +21,14 @@ def parser(subparsers, _):
       help='the url of the remote (only relevant if a new remote is created)')
   remote_parser.add_argument(
       '-d', '--delete', nargs='+', help='delete remote(es)', dest='delete_r',
-      metavar='remote')
+      metavar='remote').completer = completion.RefCompleter(
+          repo, completion.REMOTE)
   remote_parser.add_argument(
       '-rn', '--rename', nargs='+',
       help='renames the specified remote: accepts two arguments '
       '(current remote name and new remote name)',
-      dest='rename_r')
+      dest='rename_r').completer = completion.RefCompleter(
+          repo, completion.REMOTE)
   remote_parser.set_defaults(func=main)
 
 
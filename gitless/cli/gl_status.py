@@ -5,7 +5,12 @@
 """gl status - Show the status of files in the repo."""
 
 
+import itertools
+import json
 import os
+import select
+import sys
+import time
 
 from gitless import core
 
@@ -18,13 +23,222 @@ def parser(subparsers, repo):
   status_parser = subparsers.add_parser(
       'status', help=desc, description=desc.capitalize(), aliases=['st'])
   status_parser.add_argument(
-      'paths', nargs='*', help='the specific path(s) to status',
-      action=helpers.PathProcessor, repo=repo)
+      'paths', nargs='*', help=(
+          'the specific path(s) to status. If none is given the whole repo is '
+          'statused (or only the current directory if the '
+          'gitless.statusLimitToCwd config option is set)'),
+      action=helpers.PathProcessor, repo=repo, recursive=False)
+  status_parser.add_argument(
+      '-w', '--watch', action='store_true', help=(
+          'keep running and show the files whose status changes as they '
+          'change (Linux only)'))
+  output_group = status_parser.add_mutually_exclusive_group()
+  output_group.add_argument(
+      '--porcelain', action='store_true', help=(
+          'give the output in an easy-to-parse format for scripts: a line '
+          'per file with its type (tracked, untracked or ignored), whether it '
+          'exists at head, in the working directory, is modified and is in '
+          'conflict (1 or 0) and its path (relative to the repo root), '
+          'separated by spaces'))
+  output_group.add_argument(
+      '--json', action='store_true', help=(
+          'give the output as a JSON object per line, one for each file'))
+  status_parser.add_argument(
+      '-z', action='store_true', dest='null_terminated', help=(
+          'terminate the lines of --porcelain with NUL instead of LF'))
   status_parser.set_defaults(func=main)
 
 
+TYPE_NAMES = {
+    core.GL_STATUS_TRACKED: 'tracked',
+    core.GL_STATUS_UNTRACKED: 'untracked',
+    core.GL_STATUS_IGNORED: 'ignored',
+    }
+
+
+# How long to wait for more changes before looking at the repo in watch mode
+# (e.g., a checkout changes lots of files)
+WATCH_DELAY = 0.1
+
+
 def main(args, repo):
+  if args.watch:
+    if args.porcelain or args.json:
+      raise ValueError('--watch can\'t be used with --porcelain or --json')
+    from gitless import watcher
+    if not watcher.is_supported():
+      raise ValueError('gl status --watch is only supported on Linux')
+  if args.null_terminated and not args.porcelain:
+    raise ValueError('-z can only be used with --porcelain')
+
   curr_b = repo.current_branch
+  paths = list(args.paths) or None
+  if not paths and repo.cwd and _get_bool(repo, 'gitless.statusLimitToCwd'):
+    paths = [repo.cwd]
+  collapse_untracked_dirs = _get_bool(
+      repo, 'gitless.collapseUntrackedDirs', default=True)
+
+  if args.porcelain or args.json:
+    _print_records(
+        curr_b.status(
+            paths=paths, collapse_untracked_dirs=collapse_untracked_dirs),
+        args.json, '\0' if args.null_terminated else '\n')
+    return True
+
+  _print_branch(curr_b, repo)
+  # The table is sorted by path
+  st = curr_b.status_table(
+      paths=paths, collapse_untracked_dirs=collapse_untracked_dirs)
+  tracked_mod_list = st.filter(type=core.GL_STATUS_TRACKED, modified=True)
+  untracked_list = st.filter(type=core.GL_STATUS_UNTRACKED)
+
+  # git seems to default to true
+  relative_paths = _get_bool(repo, 'status.relativePaths', default=True)
+
+  pprint.blank()
+  _print_tracked_mod_files(tracked_mod_list, relative_paths, repo)
+  pprint.blank()
+  pprint.blank()
+  _print_untracked_files(untracked_list, relative_paths, repo)
+
+  if args.watch:
+    _watch(
+        curr_b, paths, collapse_untracked_dirs, relative_paths,
+        itertools.chain(tracked_mod_list, untracked_list))
+  return True
+
+
+def _print_records(files, as_json, terminator):
+  """Prints a record per file, as is (no colors or relative paths)."""
+  write = sys.stdout.write
+  for f in files:
+    if as_json:
+      write(json.dumps({
+          'fp': f.fp, 'type': TYPE_NAMES[f.type],
+          'exists_at_head': f.exists_at_head, 'exists_in_wd': f.exists_in_wd,
+          'modified': f.modified, 'in_conflict': f.in_conflict}))
+      write('\n')
+    else:
+      write('{0} {1:d} {2:d} {3:d} {4:d} {5}{6}'.format(
+          TYPE_NAMES[f.type], f.exists_at_head, f.exists_in_wd, f.modified,
+          f.in_conflict, f.fp, terminator))
+
+
+def _watch(curr_b, paths, collapse_untracked_dirs, relative_paths, files):
+  """Shows the files whose status changes until the user hits Ctrl-C.
+
+  Instead of statusing the repo every so often, we wait for something in it to
+  change (see gitless.watcher). The watcher of the working directory is also
+  the fsmonitor of the repo, so each status only looks at the paths that
+  changed since the previous one. If paths are given, only the ones with
+  changes under them are statused again.
+  """
+  from gitless import watcher
+  gl_repo = curr_b.gl_repo
+  wd_watcher = watcher.Watcher(gl_repo.root)
+  # The index, HEAD and the refs are in the repo dir (which the watcher of the
+  # working directory skips)
+  repo_watcher = watcher.Watcher(gl_repo.path)
+  gl_repo.fsmonitor = lambda root, token: wd_watcher.changes_since(token)
+  if paths is not None:
+    paths = [os.path.normpath(p) for p in paths]
+    if os.curdir in paths:  # the whole repo
+      paths = None
+
+  def listed(status_files):
+    return dict(
+        (f.fp, _status_item(f)) for f in status_files
+        if (f.type == core.GL_STATUS_TRACKED and f.modified) or
+        f.type == core.GL_STATUS_UNTRACKED)
+
+  branch = _branch_state(curr_b)
+  items = listed(files)
+  # Things could have changed before we started to watch, so the tokens we
+  # start with don't tell us what changed
+  wd_token = repo_token = None
+  try:
+    while wd_watcher.alive:
+      if wd_token is not None:
+        select.select([wd_watcher, repo_watcher], [], [])
+        time.sleep(WATCH_DELAY)
+      # (this also reads the pending events so that select waits again)
+      wd_token, wd_changes = wd_watcher.changes_since(wd_token)
+      repo_token, repo_changes = repo_watcher.changes_since(repo_token)
+
+      if wd_changes is None or repo_changes is None or repo_changes:
+        to_status = paths  # anything could have changed
+      elif paths is None:
+        to_status = None if wd_changes else []
+      else:
+        to_status = [p for p in paths if _has_changes(p, wd_changes)]
+      if to_status is not None and not to_status:
+        continue
+
+      curr_b = gl_repo.current_branch
+      new_branch = _branch_state(curr_b)
+      st = listed(curr_b.status_table(
+          paths=to_status, collapse_untracked_dirs=collapse_untracked_dirs))
+      if to_status is None:
+        new_items = st
+      else:
+        new_items = dict(
+            (fp, item) for fp, item in items.items()
+            if not any(_is_under(fp, p) for p in to_status))
+        new_items.update(st)
+      if new_branch != branch:
+        pprint.blank()
+        _print_branch(curr_b, gl_repo)
+      _print_changed_items(items, new_items, relative_paths, gl_repo.root)
+      branch, items = new_branch, new_items
+      sys.stdout.flush()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    wd_watcher.close()
+    repo_watcher.close()
+
+
+def _has_changes(path, changed_paths):
+  """True if any of changed_paths (as given by a watcher) is path, under it or
+  a dir with it."""
+  return any(
+      _is_under(c, path) or path.startswith(c + '/') for c in changed_paths)
+
+
+def _is_under(fp, path):
+  """True if fp (an entry of the status table) is path or is under it."""
+  return fp.rstrip('/') == path or fp.startswith(path + '/')
+
+
+def _branch_state(curr_b):
+  return (curr_b.branch_name, curr_b.merge_in_progress, curr_b.fuse_in_progress)
+
+
+def _print_changed_items(items, new_items, relative_paths, root):
+  """Prints the entries of new_items that are not in items (or changed)."""
+  changed = sorted(
+      fp for fp in set(items) | set(new_items)
+      if items.get(fp) != new_items.get(fp))
+  if not changed:
+    return
+
+  sections = (
+      ('Tracked files with modifications:', core.GL_STATUS_TRACKED),
+      ('Untracked files:', core.GL_STATUS_UNTRACKED),
+      ('No longer modified or untracked:', None))
+  pprint.blank()
+  for title, t in sections:
+    fps = [fp for fp in changed if new_items.get(fp, (None,))[0] == t]
+    if not fps:
+      continue
+    pprint.msg(title)
+    for fp in fps:
+      _, color, exp = new_items.get(fp, (None, None, ''))
+      display_fp = _display_path(fp, relative_paths, root)
+      pprint.item(color(display_fp) if color else display_fp, opt_text=exp)
+
+
+def _print_branch(curr_b, repo):
   pprint.msg('On branch {0}, repo-directory {1}'.format(
     pprint.green(curr_b.branch_name), pprint.green('//' + repo.cwd)))
 
@@ -35,31 +249,12 @@ def main(args, repo):
     pprint.blank()
     _print_conflict_exp('fuse')
 
-  tracked_mod_list = []
-  untracked_list = []
-  paths = frozenset(args.paths)
-  for f in curr_b.status():
-    if paths and (f.fp not in paths):
-      continue
-    if f.type == core.GL_STATUS_TRACKED and f.modified:
-      tracked_mod_list.append(f)
-    elif f.type == core.GL_STATUS_UNTRACKED:
-      untracked_list.append(f)
 
-  relative_paths = True  # git seems to default to true
+def _get_bool(repo, key, default=False):
   try:
-    relative_paths = repo.config.get_bool('status.relativePaths')
+    return repo.config.get_bool(key)
   except KeyError:
-    pass
-
-  pprint.blank()
-  tracked_mod_list.sort(key=lambda f: f.fp)
-  _print_tracked_mod_files(tracked_mod_list, relative_paths, repo)
-  pprint.blank()
-  pprint.blank()
-  untracked_list.sort(key=lambda f: f.fp)
-  _print_untracked_files(untracked_list, relative_paths, repo)
-  return True
+    return default
 
 
 def _print_tracked_mod_files(tracked_mod_list, relative_paths, repo):
@@ -78,19 +273,8 @@ def _print_tracked_mod_files(tracked_mod_list, relative_paths, repo):
 
   root = repo.root
   for f in tracked_mod_list:
-    exp = ''
-    color = pprint.yellow
-    if not f.exists_at_head:
-      exp = ' (new file)'
-      color = pprint.green
-    elif not f.exists_in_wd:
-      exp = ' (deleted)'
-      color = pprint.red
-    elif f.in_conflict:
-      exp = ' (with conflicts)'
-      color = pprint.cyan
-
-    fp = os.path.relpath(os.path.join(root, f.fp)) if relative_paths else f.fp
+    _, color, exp = _status_item(f)
+    fp = _display_path(f.fp, relative_paths, root)
     if fp == '.':
       continue
 
@@ -109,7 +293,29 @@ def _print_untracked_files(untracked_list, relative_paths, repo):
 
   root = repo.root
   for f in untracked_list:
-    exp = ''
+    _, color, exp = _status_item(f)
+    fp = _display_path(f.fp, relative_paths, root)
+    if fp == '.':
+      continue
+
+    pprint.item(color(fp), opt_text=exp)
+
+
+def _status_item(f):
+  """Returns the type, color function and explanation to show for f."""
+  exp = ''
+  if f.type == core.GL_STATUS_TRACKED:
+    color = pprint.yellow
+    if not f.exists_at_head:
+      exp = ' (new file)'
+      color = pprint.green
+    elif not f.exists_in_wd:
+      exp = ' (deleted)'
+      color = pprint.red
+    elif f.in_conflict:
+      exp = ' (with conflicts)'
+      color = pprint.cyan
+  else:
     color = pprint.blue
     if f.in_conflict:
       exp = ' (with conflicts)'
@@ -120,12 +326,16 @@ def _print_untracked_files(untracked_list, relative_paths, repo):
         exp = ' (exists at head)'
       else:
         exp = ' (exists at head but not in working directory)'
+  return f.type, color, exp
 
-    fp = os.path.relpath(os.path.join(root, f.fp)) if relative_paths else f.fp
-    if fp == '.':
-      continue
 
-    pprint.item(color(fp), opt_text=exp)
+def _display_path(fp, relative_paths, root):
+  if not relative_paths:
+    return fp
+  ret = os.path.relpath(os.path.join(root, fp))
+  if fp.endswith('/'):  # a collapsed untracked dir
+    ret += os.sep
+  return ret
 
 
 def _print_conflict_exp(op):
@@ -5,15 +5,17 @@
 """gl switch - Switch branches."""
 
 
-from . import pprint
+from . import completion, pprint
 
 
-def parser(subparsers, _):
+def parser(subparsers, repo):
   """Adds the switch parser to the given subparsers object."""
   desc = 'switch branches'
   switch_parser = subparsers.add_parser(
       'switch', help=desc, description=desc.capitalize(), aliases=['sw'])
-  switch_parser.add_argument('branch', help='switch to branch')
+  switch_parser.add_argument(
+      'branch', help='switch to branch').completer = completion.RefCompleter(
+          repo, completion.BRANCH)
   switch_parser.add_argument(
       '-mo', '--move-over',
       help='move uncomitted changes made in the current branch to the '
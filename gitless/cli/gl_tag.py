@@ -7,10 +7,10 @@
 
 from gitless import core
 
-from . import helpers, pprint
+from . import completion, helpers, pprint
 
 
-def parser(subparsers, _):
+def parser(subparsers, repo):
   """Adds the tag parser to the given subparsers object."""
   desc = 'list, create, or delete tags'
   tag_parser = subparsers.add_parser(
@@ -34,7 +34,7 @@ def parser(subparsers, _):
   delete_group = tag_parser.add_argument_group('delete tags')
   delete_group.add_argument(
       '-d', '--delete', nargs='+', help='delete tag(s)', dest='delete_t',
-      metavar='tag')
+      metavar='tag').completer = completion.RefCompleter(repo, completion.TAG)
 
   tag_parser.set_defaults(func=main)
 
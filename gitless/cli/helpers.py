@@ -6,11 +6,11 @@
 
 
 import argparse
+import contextlib
 import os
 import subprocess
 import sys
 import shlex
-import shutil
 
 from gitless import core
 
@@ -64,37 +64,82 @@ def get_branch_or_use_upstream(branch_name, arg, repo):
   return ret
 
 
-def page(fp, repo):
+@contextlib.contextmanager
+def pager(repo):
+  """Context manager that pages what's written to the stream it gives.
+
+  The output goes to the pager through a pipe as it is written, so the user
+  can start looking at it before it's all generated. The pager is launched
+  the first time something is written (nothing is paged if there's no output).
+  If the user quits the pager before all the output is written, the with block
+  is left early (the rest of the output is not generated).
+
+  If stdout is not a terminal, the output goes to stdout as is.
+  """
   if not sys.stdout.isatty():  # we are being piped or redirected
     if sys.platform != 'win32':
       # Prevent Python from throwing exceptions on SIGPIPE
       from signal import signal, SIGPIPE, SIG_DFL
       signal(SIGPIPE, SIG_DFL)
-    # memory-friendly way to output contents of file to stdout
-    with open(fp, 'r') as f:
-      shutil.copyfileobj(f, sys.stdout)
+    yield sys.stdout.write
     return
 
-  # On Windows, we need to call 'more' through cmd.exe (with 'cmd'). The /C is
-  # so that the command window gets closed after 'more' finishes
-  default_pager = 'less' if sys.platform != 'win32' else 'cmd /C more'
-  try:
-    pager = repo.config['core.pager']
-  except KeyError:
-    pager = '' # empty string will evaluate to False below
-  pager = pager or os.environ.get('PAGER', None) or default_pager
-  cmd = shlex.split(pager) # split into constituents
-  if os.path.basename(cmd[0]) == 'less':
-    cmd.extend(['-r', '-f']) # append arguments
-
-  cmd.append(fp) # add file name to page command
+  p = _Pager(repo)
   try:
-    ret = subprocess.call(cmd, stdin=sys.stdin, stdout=sys.stdout)
+    yield p.write
+  except BrokenPipeError:  # the user quit the pager
+    pass
+  finally:
+    p.close()
+
+
+class _Pager(object):
+
+  def __init__(self, repo):
+    self._repo = repo
+    self._proc = None
+    self._write = None
+
+  def write(self, s):
+    if not self._write:
+      self._start()
+    self._write(s)
+
+  def close(self):
+    if not self._proc:
+      return
+    try:
+      self._proc.stdin.close()
+    except BrokenPipeError:
+      pass
+    ret = self._proc.wait()
     if ret != 0:
-      pprint.err('Call to pager {0} failed'.format(pager))
-  except OSError:
-    pprint.err('Couldn\'t launch pager {0}'.format(pager))
-    pprint.err_exp('change the value of git\'s core.pager setting')
+      pprint.err('Call to pager {0} failed'.format(self._pager))
+
+  def _start(self):
+    # On Windows, we need to call 'more' through cmd.exe (with 'cmd'). The /C
+    # is so that the command window gets closed after 'more' finishes
+    default_pager = 'less' if sys.platform != 'win32' else 'cmd /C more'
+    try:
+      pager = self._repo.config['core.pager']
+    except KeyError:
+      pager = '' # empty string will evaluate to False below
+    self._pager = pager or os.environ.get('PAGER', None) or default_pager
+    cmd = shlex.split(self._pager) # split into constituents
+    if os.path.basename(cmd[0]) == 'less':
+      cmd.append('-r') # append arguments
+
+    # Whatever was written to stdout before should come before the pager
+    sys.stdout.flush()
+    try:
+      self._proc = subprocess.Popen(
+          cmd, stdin=subprocess.PIPE, stdout=sys.stdout,
+          encoding=sys.stdout.encoding, errors=sys.stdout.errors)
+      self._write = self._proc.stdin.write
+    except OSError:
+      pprint.err('Couldn\'t launch pager {0}'.format(self._pager))
+      pprint.err_exp('change the value of git\'s core.pager setting')
+      self._write = sys.stdout.write
 
 
 class PathProcessor(argparse.Action):
@@ -184,8 +229,8 @@ def oei_fs(args, repo):
   else:
     # Tracked modified files
     ret = frozenset(
-        f.fp for f in curr_b.status()
-        if f.type == core.GL_STATUS_TRACKED and f.modified) # using generator expression
+        curr_b.status_table(include_untracked=False).filter(
+            type=core.GL_STATUS_TRACKED, modified=True).fps())
     # We get the files from status with forward slashes. On Windows, these
     # won't match the paths provided by the user, which are normalized by
     # PathProcessor
@@ -214,6 +259,7 @@ def _oei_validate(only, exclude, include, curr_b):
     return False
 
   err = []
+  statuses = curr_b.status_files(only | exclude | include)
 
   def validate(fps, check_fn, msg):
     ''' fps: files
@@ -225,7 +271,7 @@ def _oei_validate(only, exclude, include, curr_b):
       return ret
     for fp in fps:
       try:
-        f = curr_b.status_file(fp)
+        f = statuses[fp]
       except KeyError:
         err.append('File {0} doesn\'t exist'.format(fp))
         ret = False # set error flag, but keep assessing other files
@@ -12,7 +12,6 @@ except ImportError:
 
 from datetime import datetime, tzinfo, timedelta
 from locale import getpreferredencoding
-import re
 import sys
 
 DISABLE_COLOR = False
@@ -379,32 +378,66 @@ def _format_line(diff_line, padding, bold_delim=None):
 def _highlight(line1, line2):
   """Returns the sections that should be bolded in the given lines.
 
+  The section of each line is what's left after taking out the longest common
+  prefix (not counting leading whitespace) and suffix (not counting trailing
+  whitespace) of the lines.
+
   Returns:
     two tuples. Each tuple indicates the start and end of the section
     of the line that should be bolded for line1 and line2 respectively.
    """
-  start1 = start2 = 0
-  match = re.search(r'\S', line1)  # ignore leading whitespace
-  if match:
-    start1 = match.start()
-  match = re.search(r'\S', line2)
-  if match:
-    start2 = match.start()
+  # Ignore leading whitespace
+  start1 = _leading_whitespace_len(line1)
+  start2 = _leading_whitespace_len(line2)
   length = min(len(line1), len(line2)) - 1
-  bold_start1 = start1
-  bold_start2 = start2
-  while (bold_start1 <= length and bold_start2 <= length and
-         line1[bold_start1] == line2[bold_start2]):
-    bold_start1 += 1
-    bold_start2 += 1
-  match = re.search(r'\s*$', line1)  # ignore trailing whitespace
-  bold_end1 = match.start() - 1
-  match = re.search(r'\s*$', line2)
-  bold_end2 = match.start() - 1
-  while (bold_end1 >= bold_start1 and bold_end2 >= bold_start2 and
-         line1[bold_end1] == line2[bold_end2]):
-    bold_end1 -= 1
-    bold_end2 -= 1
+  prefix = _common_prefix_len(
+      line1, start1, line2, start2,
+      min(length - start1, length - start2) + 1)
+  bold_start1 = start1 + prefix
+  bold_start2 = start2 + prefix
+  # Ignore trailing whitespace
+  bold_end1 = len(line1.rstrip()) - 1
+  bold_end2 = len(line2.rstrip()) - 1
+  suffix = _common_suffix_len(
+      line1, bold_end1, line2, bold_end2,
+      min(bold_end1 - bold_start1, bold_end2 - bold_start2) + 1)
+  bold_end1 -= suffix
+  bold_end2 -= suffix
   if bold_start1 - start1 > 0 or len(line1) - 1 - bold_end1 > 0:
     return (bold_start1 + 1, bold_end1 + 2), (bold_start2 + 1, bold_end2 + 2)
   return None, None
+
+
+def _leading_whitespace_len(line):
+  stripped = line.lstrip()
+  return len(line) - len(stripped) if stripped else 0  # (all whitespace)
+
+
+# Lines can be very long (e.g., minified code), so instead of comparing them a
+# char at a time, we binary search for the length of their common prefix (or
+# suffix) comparing slices
+
+def _common_prefix_len(line1, start1, line2, start2, max_len):
+  """Returns the length (up to max_len) of the common prefix of line1[start1:]
+  and line2[start2:]."""
+  lo, hi = 0, max(max_len, 0)
+  while lo < hi:
+    mid = (lo + hi + 1) // 2
+    if line1[start1:start1 + mid] == line2[start2:start2 + mid]:
+      lo = mid
+    else:
+      hi = mid - 1
+  return lo
+
+
+def _common_suffix_len(line1, end1, line2, end2, max_len):
+  """Returns the length (up to max_len) of the common suffix of
+  line1[:end1 + 1] and line2[:end2 + 1]."""
+  lo, hi = 0, max(max_len, 0)
+  while lo < hi:
+    mid = (lo + hi + 1) // 2
+    if line1[end1 + 1 - mid:end1 + 1] == line2[end2 + 1 - mid:end2 + 1]:
+      lo = mid
+    else:
+      hi = mid - 1
+  return lo
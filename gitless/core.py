@@ -5,7 +5,10 @@
 """Gitless's library."""
 
 
+import array
 import collections
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 import errno
 import io
 
@@ -13,14 +16,25 @@ import itertools
 import json
 from locale import getpreferredencoding
 import os
+import posixpath
 import re
 import shutil
+import stat
+import struct
 import sys
+import time
 
 import pygit2
+# Some things (like the flags of index entries or giving a pathspec to a diff)
+# are not exposed by pygit2, for those we go to libgit2 directly
+from pygit2.errors import check_error
+from pygit2.ffi import ffi, C
+from pygit2.utils import StrArray
 
 from subprocess import run, CalledProcessError
 
+from gitless import trace
+
 ENCODING = getpreferredencoding() or 'utf-8'
 
 
@@ -37,6 +51,11 @@ class ApplyFailedError(GlError): pass
 class PathIsDirectoryError(ValueError): pass
 
 
+# Files larger than this (in bytes) are not diffed (unless the
+# core.bigFileThreshold config option says otherwise)
+BIG_FILE_THRESHOLD = 512 * 1024 * 1024
+
+
 # File status
 
 GL_STATUS_UNTRACKED = 1
@@ -105,6 +124,11 @@ class Repository(object):
     config: the repository's configuration.
     current_branch: the current branch (a Branch object).
     remotes: the configured remotes (see RemoteCollection).
+    fsmonitor: if set, a function that, given the root of the repository and
+      a token (or None), returns a new token and the paths (relative to the
+      root) that changed since the given token was returned. If it can't tell
+      which paths changed it returns None as the paths. Status uses it (as
+      git uses core.fsmonitor) to only look at what changed.
   """
 
   def __init__(self):
@@ -119,6 +143,120 @@ class Repository(object):
     self.path = self.git_repo.path
     self.root = self.path[:-6]  # strip trailing /.git/
     self.config = self.git_repo.config
+    self.fsmonitor = None
+    self._au_cache = None
+    self._status_cache = _StatusCache(self)
+
+  def _au_files(self):
+    """Returns the set of paths of the files marked as assumed unchanged.
+
+    The set is cached (also across runs, see _StatusCache) until the index
+    changes.
+    """
+    stamp = self._index_stamp()
+    if not self._au_cache or self._au_cache[0] != stamp:
+      au_files = self._status_cache.au_files(stamp)
+      if au_files is None:
+        with trace.span('read_au_files'):
+          au_files = self._index_paths(au_only=True) if stamp else []
+        self._status_cache.set_au_files(stamp, au_files)
+      self._au_cache = (stamp, frozenset(au_files))
+    return self._au_cache[1]
+
+  def _index_stamp(self):
+    try:
+      st = os.stat(os.path.join(self.path, 'index'))
+    except OSError:  # no index yet
+      return None
+    # The index is rewritten by renaming a new file into place, so any change
+    # to it gives us a different inode
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+  def _index_paths(self, au_only=False):
+    """Returns the paths of the entries in the index (see _index_paths)."""
+    paths = _index_paths(os.path.join(self.path, 'index'), au_only=au_only)
+    if paths is None:  # unsupported index version, ask libgit2
+      index = self._read_index()
+      paths = []
+      for i in range(len(index)):
+        entry = C.git_index_get_byindex(index._index, i)
+        if not au_only or entry.flags & _INDEX_ENTRY_VALID:
+          paths.append(ffi.string(entry.path).decode('utf-8'))
+    return paths
+
+  def _is_au(self, git_path):
+    """True if the file at git_path is marked as assumed unchanged."""
+    index = self._read_index()
+    entry = C.git_index_get_bypath(index._index, git_path.encode('utf-8'), 0)
+    return entry != ffi.NULL and bool(entry.flags & _INDEX_ENTRY_VALID)
+
+  def _read_index(self):
+    index = self.git_repo.index
+    index.read(False)  # only if it changed on disk
+    return index
+
+  def _big_file_threshold(self):
+    """Returns the size (in bytes) above which files are not diffed.
+
+    It's given by the core.bigFileThreshold config option (as in git). It
+    defaults to 512 MiB.
+    """
+    try:
+      return self.config.get_int('core.bigFileThreshold')
+    except (KeyError, ValueError):
+      return BIG_FILE_THRESHOLD
+
+  def _status_threads(self):
+    """Returns the number of threads to use for statusing the whole repo.
+
+    It's given by the gitless.statusThreads config option (0 means one per
+    CPU). It defaults to 1.
+    """
+    try:
+      threads = self.config.get_int('gitless.statusThreads')
+    except (KeyError, ValueError):
+      return 1
+    if threads == 0:
+      threads = os.cpu_count() or 1
+    return max(threads, 1)
+
+  def _git_status(self, **kwargs):
+    """Like _git_status (for the whole repo) but using the status threads.
+
+    With more than one thread, the entries at the root of the repo (those in
+    the index and those in the working directory) are split into contiguous
+    shards with about the same number of index entries, and each shard is
+    statused (with its entries as the pathspec) in a thread of its own.
+    libgit2 doesn't hold the GIL while it stats the files of a shard and walks
+    its untracked dirs, so this helps when stat calls are slow (e.g., a cold
+    cache or a network filesystem). Subdirs are not split any further since
+    libgit2 doesn't collapse an untracked dir that is not at the root if it's
+    given as the pathspec.
+    """
+    threads = self._status_threads()
+    if threads == 1:
+      return _git_status(self.git_repo, **kwargs)
+
+    weights = collections.Counter(
+        path.split('/', 1)[0] for path in self._index_paths())
+    for name in os.listdir(self.root):
+      if name != '.git' and name not in weights:
+        weights[name] = 1  # untracked, could be anything
+    shards = _split(sorted(weights.items()), threads)
+    if len(shards) <= 1:
+      return _git_status(self.git_repo, **kwargs)
+
+    index = self._read_index()
+    with trace.span('status_shards', shards=len(shards)):
+      with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        results = list(executor.map(
+            lambda shard: _git_status(
+                self.git_repo, paths=shard, index=index, **kwargs),
+            shards))
+    ret = {}
+    for result in results:
+      ret.update(result)
+    return ret
 
   @property
   def cwd(self):
@@ -273,11 +411,11 @@ class Repository(object):
       msg = _stash_msg(b.branch_name)
 
       # Save assumed unchanged info
-      au_fps = list(b._au_files())
+      au_fps = self._au_files()
       if au_fps:
         with io.open(au_fp(b), mode='w', encoding=ENCODING) as f:
-          f.write(' '.join(au_fps))
-        git('update-index', '--no-assume-unchanged', *au_fps, cwd=self.root)
+          f.write('\0'.join(au_fps))
+        _update_index('--no-assume-unchanged', au_fps, self.root)
 
       if b.merge_in_progress or b.fuse_in_progress:
         body = {}
@@ -339,18 +477,23 @@ class Repository(object):
           git('stash', 'save', '--all', '--', msg)
 
     def restore(b):
-      s_id, msg = _stash(_stash_msg(b.branch_name))
-      if not s_id:
-        return
-
       def restore_au_info():
         au = au_fp(b)
         if os.path.exists(au):
           with io.open(au, mode='r', encoding=ENCODING) as f:
             au_fps = f.read()
-          git('update-index', '--assume-unchanged', *au_fps.split())
+          # Older versions separated paths with spaces
+          au_fps = au_fps.split('\0') if '\0' in au_fps else au_fps.split()
+          _update_index('--assume-unchanged', au_fps, self.root)
           os.remove(au)
 
+      s_id, msg = _stash(_stash_msg(b.branch_name))
+      if not s_id:
+        # Nothing was stashed (e.g., there were no changes other than files
+        # being assumed unchanged)
+        restore_au_info()
+        return
+
       split_msg = msg.split(INFO_SEP)
 
       if len(split_msg) == 1:  # No op to restore
@@ -401,7 +544,8 @@ class Repository(object):
         restore_au_info()
 
     save(self.current_branch)
-    git_repo.checkout(dst_b.git_branch)
+    with trace.span('pygit2.checkout', branch=dst_b.branch_name):
+      git_repo.checkout(dst_b.git_branch)
     restore(dst_b)
 
 
@@ -622,8 +766,10 @@ class RemoteBranch(object):
     self._update()
     return self.git_branch.peel()
 
-  def history(self, reverse=False):
-    return walker(self.gl_repo.git_repo, self.target, reverse=reverse)
+  def history(self, reverse=False, topological=True):
+    return walker(
+        self.gl_repo.git_repo, self.target, reverse=reverse,
+        topological=topological)
 
   def _update(self):
     git('fetch', self.remote_name, self.branch_name)
@@ -634,6 +780,90 @@ class RemoteBranch(object):
     return self.remote_name + '/' + self.branch_name
 
 
+class StatusTable(object):
+  """The statuses of many files (see Branch.status_table), stored compactly.
+
+  Instead of a FileStatus with a path string per file, the paths (sorted) are
+  kept in a single string and the status of each file is packed into a byte.
+  FileStatus objects are only built, one at a time, when iterating over the
+  table. Use fps to get just the paths and filter to select some files without
+  building them at all.
+  """
+
+  _TYPE_MASK = 0x3
+  _EXISTS_AT_HEAD = 0x4
+  _EXISTS_IN_WD = 0x8
+  _MODIFIED = 0x10
+  _IN_CONFLICT = 0x20
+
+  def __init__(self, statuses=None, _table=None, _rows=None):
+    """Create a StatusTable.
+
+    Args:
+      statuses: a dict mapping paths to their packed status (see pack).
+    """
+    if _table is not None:  # a view of (some of the rows of) another table
+      self._paths, self._offsets, self._flags = _table
+      self._rows = _rows
+      return
+    fps = sorted(statuses)
+    self._paths = '\0'.join(fps)
+    self._offsets = array.array('L', [0])
+    offset = 0
+    for fp in fps:
+      offset += len(fp) + 1
+      self._offsets.append(offset)
+    self._flags = bytes(statuses[fp] for fp in fps)
+    self._rows = None
+
+  @classmethod
+  def pack(cls, type, exists_at_head, exists_in_wd, modified, in_conflict):
+    """Returns the packed status (a byte) of a file."""
+    return (
+        type |
+        (cls._EXISTS_AT_HEAD if exists_at_head else 0) |
+        (cls._EXISTS_IN_WD if exists_in_wd else 0) |
+        (cls._MODIFIED if modified else 0) |
+        (cls._IN_CONFLICT if in_conflict else 0))
+
+  def __len__(self):
+    return len(self._flags) if self._rows is None else len(self._rows)
+
+  def __iter__(self):
+    file_status = Branch.FileStatus
+    for i in self._indices():
+      st = self._flags[i]
+      yield file_status(
+          self._fp(i), st & self._TYPE_MASK, bool(st & self._EXISTS_AT_HEAD),
+          bool(st & self._EXISTS_IN_WD), bool(st & self._MODIFIED),
+          bool(st & self._IN_CONFLICT))
+
+  def fps(self):
+    """Returns a generator of the paths of the files in the table (sorted)."""
+    return (self._fp(i) for i in self._indices())
+
+  def filter(self, type=None, modified=None):
+    """Returns a view of the table with only the files of the given type
+    and/or that are (or are not) modified."""
+    mask, value = 0, 0
+    if type is not None:
+      mask, value = self._TYPE_MASK, type
+    if modified is not None:
+      mask |= self._MODIFIED
+      value |= self._MODIFIED if modified else 0
+    flags = self._flags
+    rows = array.array(
+        'L', (i for i in self._indices() if flags[i] & mask == value))
+    return StatusTable(
+        _table=(self._paths, self._offsets, self._flags), _rows=rows)
+
+  def _indices(self):
+    return range(len(self._flags)) if self._rows is None else self._rows
+
+  def _fp(self, i):
+    return self._paths[self._offsets[i]:self._offsets[i + 1] - 1]
+
+
 class Branch(object):
   """An independent line of development.
 
@@ -705,11 +935,44 @@ class Branch(object):
     self.git_branch = self.gl_repo.git_repo.lookup_branch(
         self.branch_name, pygit2.GIT_BRANCH_LOCAL)
 
-  def history(self, reverse=False):
-    return walker(self.gl_repo.git_repo, self.target, reverse=reverse)
+  def history(self, reverse=False, topological=True):
+    return walker(
+        self.gl_repo.git_repo, self.target, reverse=reverse,
+        topological=topological)
 
-  def diff_commits(self, c1, c2):
-    return c1.tree.diff_to_tree(c2.tree)
+  def diff_commits(self, c1, c2, paths=None, find_renames=False):
+    """Diff the trees of commits c1 and c2.
+
+    Args:
+      c1: the commit to diff from.
+      c2: the commit to diff to.
+      paths: if given, only these paths (or the files under them, for dirs)
+        are diffed. Only the parts of the trees where they are are looked at.
+      find_renames: whether to detect renamed files (only diff.renameLimit
+        files, 1000 by default, are considered).
+
+    Returns:
+      the pygit2 Diff.
+    """
+    git_repo = self.gl_repo.git_repo
+    if paths is None:
+      diff = c1.tree.diff_to_tree(c2.tree)
+    else:
+      git_paths = [_get_git_path(path) for path in paths]
+      for path in paths:
+        _check_path_is_repo_relative(path)
+      # libgit2 (as exposed) can only diff trees with a pathspec against an
+      # index, so we put the entries of c2 under paths in an in-memory one
+      index = _tree_index(git_repo, c2.tree, git_paths)
+      with _c_tree(c1.tree) as c_tree:
+        diff = _diff(
+            git_repo, 0, git_paths,
+            lambda c_diff, c_opts: C.git_diff_tree_to_index(
+                c_diff, git_repo._repo, c_tree, index._index, c_opts),
+            max_size=self.gl_repo._big_file_threshold())
+    if find_renames:
+      _find_renames(diff, self.gl_repo.config)
+    return diff
 
   def __str__(self):
     return self.branch_name
@@ -747,6 +1010,9 @@ class Branch(object):
     pygit2.GIT_STATUS_WT_NEW: (GL_STATUS_UNTRACKED, False, True, True, False),
     pygit2.GIT_STATUS_WT_MODIFIED: (GL_STATUS_TRACKED, True, True, True, False),
     pygit2.GIT_STATUS_WT_DELETED: (GL_STATUS_TRACKED, True, False, True, False),
+    # e.g., a file replaced by a symlink
+    pygit2.GIT_STATUS_WT_TYPECHANGE: (
+      GL_STATUS_TRACKED, True, True, True, False),
 
     ### INDEX_* ###
     pygit2.GIT_STATUS_INDEX_NEW: (GL_STATUS_TRACKED, False, True, True, False),
@@ -754,6 +1020,8 @@ class Branch(object):
       GL_STATUS_TRACKED, True, True, True, False),
     pygit2.GIT_STATUS_INDEX_DELETED: (
       GL_STATUS_TRACKED, True, False, True, False),
+    pygit2.GIT_STATUS_INDEX_TYPECHANGE: (
+      GL_STATUS_TRACKED, True, True, True, False),
 
     ### WT_NEW | INDEX_* ###
     # WT_NEW | INDEX_NEW -> can't happen
@@ -769,48 +1037,190 @@ class Branch(object):
     pygit2.GIT_STATUS_WT_MODIFIED | pygit2.GIT_STATUS_INDEX_MODIFIED: (
       GL_STATUS_TRACKED, True, True, True, False),
     # WT_MODIFIED | INDEX_DELETED -> can't happen
+    pygit2.GIT_STATUS_WT_MODIFIED | pygit2.GIT_STATUS_INDEX_TYPECHANGE: (
+      GL_STATUS_TRACKED, True, True, True, False),
+
+    ### WT_TYPECHANGE | INDEX_* ###
+    pygit2.GIT_STATUS_WT_TYPECHANGE | pygit2.GIT_STATUS_INDEX_NEW: (
+      GL_STATUS_TRACKED, False, True, True, False),
+    pygit2.GIT_STATUS_WT_TYPECHANGE | pygit2.GIT_STATUS_INDEX_MODIFIED: (
+      GL_STATUS_TRACKED, True, True, True, False),
+    pygit2.GIT_STATUS_WT_TYPECHANGE | pygit2.GIT_STATUS_INDEX_TYPECHANGE: (
+      GL_STATUS_TRACKED, True, True, True, False),
 
     ### WT_DELETED | INDEX_* ### -> can't happen
     }
 
+  _st_packed = dict(
+      (git_s, StatusTable.pack(*st)) for git_s, st in _st_map.items())
+
   FileStatus = collections.namedtuple(
     'FileStatus', [
         'fp', 'type', 'exists_at_head', 'exists_in_wd', 'modified',
         'in_conflict'])
 
-  def _au_files(self):
-    for f_out in git('ls-files', '-v', cwd=self.gl_repo.root).splitlines():
-      if f_out[0] == 'h':
-        yield f_out[2:].strip()
-
-  def status(self):
+  def status(
+      self, paths=None, collapse_untracked_dirs=False, include_untracked=True):
     """Return a generator of file statuses (see FileStatus).
 
+    See status_table for the arguments (it's the same as iterating over the
+    StatusTable it returns).
+    """
+    yield from self.status_table(
+        paths=paths, collapse_untracked_dirs=collapse_untracked_dirs,
+        include_untracked=include_untracked)
+
+  def status_table(
+      self, paths=None, collapse_untracked_dirs=False, include_untracked=True):
+    """Return the status of the files as a StatusTable.
+
     Ignored and tracked unmodified files are not reported.
     File paths are always relative to the repo root.
+
+    The status of the whole repo is computed with the help of a persistent
+    cache of untracked files (see _StatusCache), unless the
+    gitless.statusCache config option is set to false.
+
+    Args:
+      paths: if given, only files that are (or are under) one of these paths
+        (relative to the repo root) are reported. Only the parts of the repo
+        that contain them are looked at.
+      collapse_untracked_dirs: if True, a directory with no tracked files is
+        reported as a single untracked entry (its path followed by a '/')
+        instead of recursing into it and reporting each file in it.
+      include_untracked: if False, untracked files are not reported (and the
+        working directory is not searched for them).
     """
-    for fp, git_s in self.gl_repo.git_repo.status().items():
-      yield self.FileStatus(fp, *self._st_map[git_s])
+    git_paths = None
+    if paths is not None:
+      git_paths = []
+      for path in paths:
+        _check_path_is_repo_relative(path)
+        git_path = _get_git_path(os.path.normpath(path))
+        if git_path == '.':  # the whole repo
+          git_paths = None
+          break
+        git_paths.append(git_path)
 
-    # status doesn't report au files
-    au_files = list(self._au_files())
-    if au_files:
-      for fp in au_files:
-        exists_in_wd = os.path.exists(os.path.join(self.gl_repo.root, fp))
-        yield self.FileStatus(
-            fp, GL_STATUS_UNTRACKED, True, exists_in_wd, True, False)
+    git_repo = self.gl_repo.git_repo
+    use_cache = True
+    try:
+      use_cache = self.gl_repo.config.get_bool('gitless.statusCache')
+    except KeyError:
+      pass
+    if git_paths is None and use_cache:
+      with trace.span(
+          'status', cached=True,
+          collapse_untracked_dirs=collapse_untracked_dirs,
+          include_untracked=include_untracked) as attrs:
+        if include_untracked:
+          git_status = self.gl_repo._status_cache.status(
+              collapse_untracked_dirs)
+        else:
+          git_status = self.gl_repo._status_cache.tracked_status()
+        self.gl_repo._status_cache.save()
+        attrs['files'] = len(git_status)
+    elif git_paths is None:
+      threads = self.gl_repo._status_threads()
+      if not collapse_untracked_dirs and threads == 1 and include_untracked:
+        with trace.span('pygit2.status') as attrs:
+          git_status = git_repo.status()
+          attrs['files'] = len(git_status)
+      else:
+        with trace.span(
+            'status', threads=threads,
+            collapse_untracked_dirs=collapse_untracked_dirs,
+            include_untracked=include_untracked) as attrs:
+          git_status = self.gl_repo._git_status(
+              include_untracked=include_untracked,
+              recurse_untracked_dirs=not collapse_untracked_dirs)
+          attrs['files'] = len(git_status)
+    else:
+      with trace.span(
+          'status', paths=git_paths,
+          collapse_untracked_dirs=collapse_untracked_dirs,
+          include_untracked=include_untracked) as attrs:
+        git_status = _git_status(
+            git_repo, paths=git_paths, include_untracked=include_untracked,
+            recurse_untracked_dirs=not collapse_untracked_dirs)
+        if collapse_untracked_dirs and include_untracked and git_paths:
+          # If a path is under an untracked dir, libgit2 reports nothing for it
+          # (the dir it would collapse into is outside of the pathspec) so we
+          # look at those paths again, recursing into untracked dirs
+          root = self.gl_repo.root
+          missing = [
+              p for p in git_paths
+              if not any(fp == p or fp.startswith(p + '/') for fp in git_status)
+              and os.path.lexists(os.path.join(root, p))]
+          if missing:
+            git_status.update(_git_status(git_repo, paths=missing))
+        attrs['files'] = len(git_status)
+    packed = self._st_packed
+    statuses = dict(
+        (fp, packed[git_s]) for fp, git_s in git_status.items()
+        if git_s != _NEW_AND_REMOVED)
+    del git_status  # it can be big
+
+    # status doesn't report au files (they are untracked for us)
+    au_files = self.gl_repo._au_files() if include_untracked else []
+    if git_paths is not None:
+      au_files = [
+          fp for fp in au_files
+          if any(fp == p or fp.startswith(p + '/') for p in git_paths)]
+    for fp in au_files:
+      exists_in_wd = os.path.exists(os.path.join(self.gl_repo.root, fp))
+      statuses[fp] = StatusTable.pack(
+          GL_STATUS_UNTRACKED, True, exists_in_wd, True, False)
+    return StatusTable(statuses)
 
   def status_file(self, path):
     """Return the status (see FileStatus) of the given path."""
     return self._status_file(path)[0]
 
+  def status_files(self, paths):
+    """Return the statuses (see FileStatus) of the given paths.
+
+    This is like calling status_file on each path but all statuses are
+    computed in one pass over the repository.
+
+    Returns:
+      a dict mapping each path to its status. Paths that don't exist (for which
+      status_file would raise a KeyError) are left out.
+    """
+    paths = list(paths)
+    for path in paths:
+      _check_path_is_repo_relative(path)
+
+    git_paths = dict((_get_git_path(path), path) for path in paths)
+    with trace.span('status_files', files=len(git_paths)):
+      git_status = _git_status(
+          self.gl_repo.git_repo, paths=list(git_paths),
+          include_unmodified=True, include_ignored=True)
+    au_files = self.gl_repo._au_files()
+    root = self.gl_repo.root
+
+    ret = {}
+    for git_path, git_st in git_status.items():
+      path = git_paths.get(git_path)
+      # (path is None if it's not one of the paths we were asked about)
+      if path is None or git_st == _NEW_AND_REMOVED:
+        continue
+      if git_path in au_files:
+        exists_in_wd = os.path.exists(os.path.join(root, path))
+        ret[path] = self.FileStatus(
+            path, GL_STATUS_UNTRACKED, True, exists_in_wd, True, False)
+      else:
+        ret[path] = self.FileStatus(path, *self._st_map[git_st])
+    return ret
+
   def _status_file(self, path):
     _check_path_is_repo_relative(path)
 
-    git_st = self.gl_repo.git_repo.status_file(_get_git_path(path))
+    git_path = _get_git_path(path)
+    with trace.span('pygit2.status_file', path=git_path):
+      git_st = self.gl_repo.git_repo.status_file(git_path)
     root = self.gl_repo.root
-    cmd_out = git('ls-files', '-v', '--full-name', path, cwd=root)
-    is_au = cmd_out and cmd_out[0] == 'h'
+    is_au = self.gl_repo._is_au(git_path)
     if is_au:
       exists_in_wd = os.path.exists(os.path.join(root, path))
       f_st = self.FileStatus(
@@ -829,9 +1239,19 @@ class Branch(object):
   # File-related methods
 
   def track_file(self, path):
-    """Start tracking changes to path."""
+    """Start tracking changes to path.
+
+    If path is a directory, all untracked files under it are tracked (this is
+    how an untracked dir reported by status with collapse_untracked_dirs set
+    is expanded).
+    """
     _check_path_is_repo_relative(path)
 
+    full_path = os.path.join(self.gl_repo.root, path)
+    if os.path.isdir(full_path) and not os.path.islink(full_path):
+      self._track_dir(path)
+      return
+
     gl_st, git_st, is_au = self._status_file(path)
 
     if gl_st.type == GL_STATUS_TRACKED:
@@ -850,10 +1270,32 @@ class Branch(object):
         git_path = _get_git_path(path)
         index.add(git_path)
     elif is_au:  # Case (ii)
-      git('update-index', '--no-assume-unchanged', path, cwd=self.gl_repo.root)
+      _update_index('--no-assume-unchanged', [path], self.gl_repo.root)
     else:
       raise GlError('File {0} in unknown status {1}'.format(path, git_st))
 
+  def _track_dir(self, path):
+    git_path = _get_git_path(os.path.normpath(path))
+    if git_path == '.':
+      git_paths, prefix = None, ''
+    else:
+      git_paths, prefix = [git_path], git_path + '/'
+    new_fps = [
+        fp for fp, git_st in _git_status(
+            self.gl_repo.git_repo, paths=git_paths).items()
+        if git_st == pygit2.GIT_STATUS_WT_NEW]
+    au_fps = [fp for fp in self.gl_repo._au_files() if fp.startswith(prefix)]
+    if not new_fps and not au_fps:
+      raise ValueError(
+          'There are no untracked files to track in directory {0}'.format(path))
+
+    if new_fps:
+      with self._index as index:
+        for fp in new_fps:
+          index.add(fp)
+    if au_fps:
+      _update_index('--no-assume-unchanged', au_fps, self.gl_repo.root)
+
   def untrack_file(self, path):
     """Stop tracking changes to path."""
     _check_path_is_repo_relative(path)
@@ -880,7 +1322,7 @@ class Branch(object):
         git_path = _get_git_path(path)
         index.remove(git_path)
     elif not is_au:  # Case (ii)
-      git('update-index', '--assume-unchanged', path, cwd=self.gl_repo.root)
+      _update_index('--assume-unchanged', [path], self.gl_repo.root)
     else:
       raise GlError('File {0} in unknown status {1}'.format(path, git_st))
 
@@ -949,26 +1391,163 @@ class Branch(object):
       else:
         yield tree_entry_path
 
+  # What diff_files gives instead of a patch for files that are larger than
+  # the core.bigFileThreshold config option (large is True then) or look
+  # binary. The sizes are in bytes (old_size is None if the file doesn't exist
+  # at head, new_size if it doesn't exist in the working directory).
+  SkippedDiff = collections.namedtuple(
+      'SkippedDiff', ['fp', 'large', 'old_size', 'new_size'])
+
   def diff_file(self, path):
-    """Diff the working version of path with its committed version."""
-    _check_path_is_repo_relative(path)
+    """Diff the working version of path with its committed version.
+
+    Nothing is written to the object database: the working version is only
+    read (and diffed) in memory. See diff_files for files that are not diffed.
+    """
+    [(_, patch)] = self.diff_files([path])
+    if patch is None:
+      raise KeyError('path {0} doesn\'t exist'.format(path))
+    return patch
+
+  def diff_files(self, paths):
+    """Diff the working versions of paths with their committed versions.
+
+    This is like calling diff_file for each path, but HEAD is only resolved
+    once and all the files that exist at head are diffed in one pass.
+
+    Files larger than the core.bigFileThreshold config option (512 MiB by
+    default, as in git) at head or in the working directory and files whose
+    first few KB look binary are not diffed (or read in full, or hashed): a
+    SkippedDiff is given for them instead of a patch.
 
+    Returns:
+      a generator of (path, patch) pairs, in the order of paths. The patch is
+      None if the file doesn't exist (diff_file raises KeyError then).
+    """
+    paths = list(paths)
     git_repo = self.gl_repo.git_repo
-    git_path = _get_git_path(path)
-    try:
-      blob_at_head = git_repo[git_repo.head.peel().tree[git_path].id]
-    except KeyError:  # no blob at head
-      wt_blob = git_repo[git_repo.create_blob_fromworkdir(git_path)]
-      nil_blob = git_repo[git_repo.create_blob('')]
-      return nil_blob.diff(wt_blob, 0, git_path, git_path)
+    tree = git_repo.head.peel().tree
+    root = self.gl_repo.root
+    threshold = self.gl_repo._big_file_threshold()
+    git_paths = []
+    skipped = {}  # path -> (large, size at head (or its id), size in the wd)
+    # We diff the working directory against an in-memory index that only has
+    # the committed versions of the files. libgit2 then reads (and filters)
+    # the working versions as it would when creating blobs out of them
+    index = pygit2.Index()
+    for path in paths:
+      _check_path_is_repo_relative(path)
+      git_path = _get_git_path(path)
+      git_paths.append(git_path)
+      try:
+        entry = tree[git_path]
+      except KeyError:  # no blob at head
+        entry = None
+      skip = _skip_diff(
+          git_repo, os.path.join(root, path), git_path, threshold)
+      if skip:
+        large, size = skip
+        skipped[path] = [large, entry.id if entry else None, size]
+      elif entry:
+        index.add(pygit2.IndexEntry(git_path, entry.id, entry.filemode))
+
+    # We only need the sizes of the skipped files at head (which git can get
+    # without reading the blobs)
+    at_head = [info for info in skipped.values() if info[1]]
+    if at_head:
+      for info, size in zip(at_head, _object_sizes(
+          [info[1] for info in at_head], root)):
+        info[1] = size
+
+    deltas = {}
+    if len(index):  # (an empty pathspec would match everything)
+      with trace.span('diff_index_to_workdir', files=len(index)):
+        diff = _diff(
+            git_repo, pygit2.GIT_DIFF_DISABLE_PATHSPEC_MATCH,
+            [entry.path for entry in index],
+            lambda c_diff, c_opts: C.git_diff_index_to_workdir(
+                c_diff, git_repo._repo, index._index, c_opts),
+            max_size=threshold)
+      # The patches are only built as they are needed
+      deltas = dict(
+          (delta.old_file.path, i) for i, delta in enumerate(diff.deltas))
+
+    for path, git_path in zip(paths, git_paths):
+      if path in skipped:
+        yield path, self.SkippedDiff(path, *skipped[path])
+        continue
+      if git_path in index:
+        i = deltas.get(git_path)
+        if i is not None:
+          patch = diff[i]
+          delta = patch.delta
+          # The working version is small (or gone), but the committed one
+          # could be large (libgit2 then only reads its size)
+          if delta.is_binary and delta.old_file.size > threshold:
+            new_size = (
+                None if delta.status == pygit2.GIT_DELTA_DELETED
+                else delta.new_file.size)
+            patch = self.SkippedDiff(path, True, delta.old_file.size, new_size)
+          yield path, patch
+        else:  # there are no changes
+          blob_at_head = git_repo[index[git_path].id]
+          yield path, blob_at_head.diff(blob_at_head, 0, git_path, git_path)
+        continue
+      try:
+        contents = _read_wd_file(os.path.join(root, path))
+      except KeyError:
+        yield path, None
+      else:
+        yield path, _BufferPatch(contents, git_path)
 
-    try:
-      wt_blob = git_repo[git_repo.create_blob_fromworkdir(git_path)]
-    except KeyError:  # no blob at wd (the file was deleted)
-      nil_blob = git_repo[git_repo.create_blob('')]
-      return blob_at_head.diff(nil_blob, 0, git_path, git_path)
+  def diff_wd(self, commit, paths=None, find_renames=False):
+    """Diff the tree of commit with the working directory.
+
+    Tracked files are diffed in their working versions. Untracked files that
+    exist at head are diffed in their committed versions.
 
-    return blob_at_head.diff(wt_blob, 0, git_path, git_path)
+    Args:
+      commit: the commit to diff from.
+      paths: if given, only these paths (or the files under them, for dirs)
+        are diffed.
+      find_renames: whether to detect renamed files (see diff_commits).
+
+    Returns:
+      the pygit2 Diff.
+    """
+    git_repo = self.gl_repo.git_repo
+    git_paths = None
+    if paths is not None:
+      for path in paths:
+        _check_path_is_repo_relative(path)
+      git_paths = [_get_git_path(path) for path in paths]
+    index = git_repo.index
+    index.read(False)  # only if it changed on disk
+    max_size = self.gl_repo._big_file_threshold()
+    # This is what git_diff_tree_to_workdir_with_index (not exposed) does
+    with _c_tree(commit.tree) as c_tree:
+      diff = _diff(
+          git_repo, 0, git_paths,
+          lambda c_diff, c_opts: C.git_diff_tree_to_index(
+              c_diff, git_repo._repo, c_tree, index._index, c_opts),
+          max_size=max_size)
+    diff.merge(_diff(
+        git_repo, 0, git_paths,
+        lambda c_diff, c_opts: C.git_diff_index_to_workdir(
+            c_diff, git_repo._repo, index._index, c_opts),
+        max_size=max_size))
+    if find_renames:
+      _find_renames(diff, self.gl_repo.config)
+    # Like in git, a file modified in the index and then changed back in the
+    # working directory is left in the merged diff (without changes)
+    positions = [
+        i for i, delta in enumerate(diff.deltas)
+        if delta.status != pygit2.GIT_DELTA_MODIFIED or
+        delta.old_file.id != delta.new_file.id or
+        delta.old_file.mode != delta.new_file.mode]
+    if len(positions) == len(diff):
+      return diff
+    return _DiffView(diff, positions)
 
 
   # Merge-related methods
@@ -1172,7 +1751,8 @@ class Branch(object):
     git_repo = self.gl_repo.git_repo
     tree = git_repo[cid].tree
     try:
-      git_repo.checkout_tree(tree)
+      with trace.span('pygit2.checkout_tree'):
+        git_repo.checkout_tree(tree)
     except pygit2.GitError:  # conflicts prevent checkout
       # TODO: this hack will cover most cases, but it won't help if the conflict
       # is caused by untracked files (nonetheless `stash pop` won't work in that
@@ -1180,7 +1760,8 @@ class Branch(object):
       if save_fn:
         save_fn()
       git('stash', 'save', '--', msg_fn(self))
-      git_repo.checkout_tree(tree)
+      with trace.span('pygit2.checkout_tree'):
+        git_repo.checkout_tree(tree)
     git_repo.reset(cid, pygit2.GIT_RESET_SOFT)
 
   def _safe_restore(self, msg_fn, restore_fn=None):
@@ -1354,6 +1935,684 @@ def _stash_msg_merge(name):
   return _stash_msg('merge-{0}'.format(name))
 
 
+# Helpers for status
+
+# How the statuses of the deltas of a diff between HEAD and the index and of
+# a diff between the index and the working directory translate into status
+# flags (this is what libgit2's status does)
+_INDEX_DELTA_ST = {
+    pygit2.GIT_DELTA_ADDED: pygit2.GIT_STATUS_INDEX_NEW,
+    pygit2.GIT_DELTA_DELETED: pygit2.GIT_STATUS_INDEX_DELETED,
+    pygit2.GIT_DELTA_MODIFIED: pygit2.GIT_STATUS_INDEX_MODIFIED,
+    pygit2.GIT_DELTA_TYPECHANGE: pygit2.GIT_STATUS_INDEX_MODIFIED,
+    }
+_WT_DELTA_ST = {
+    pygit2.GIT_DELTA_DELETED: pygit2.GIT_STATUS_WT_DELETED,
+    pygit2.GIT_DELTA_MODIFIED: pygit2.GIT_STATUS_WT_MODIFIED,
+    pygit2.GIT_DELTA_TYPECHANGE: pygit2.GIT_STATUS_WT_MODIFIED,
+    pygit2.GIT_DELTA_UNTRACKED: pygit2.GIT_STATUS_WT_NEW,
+    pygit2.GIT_DELTA_IGNORED: pygit2.GIT_STATUS_IGNORED,
+    }
+
+# A file that was tracked and then removed before it was ever committed. As far
+# as gl is concerned, it doesn't exist (status_file raises KeyError for it)
+_NEW_AND_REMOVED = pygit2.GIT_STATUS_INDEX_NEW | pygit2.GIT_STATUS_WT_DELETED
+
+class _StatusCache(object):
+  """A cache of the parts of the status of a repo that are costly to get.
+
+  The cache is persisted under the git dir and has the set of files marked as
+  assumed unchanged and, as git's untracked cache does, the untracked files
+  found in each directory along with the directory's mtime. Adding or removing
+  a file in a directory changes its mtime, so on a later status only the
+  directories whose mtime changed need to be looked at again. Tracked files
+  are still compared to the index (this needs a stat of each file). The whole
+  cache is discarded if the index changes. Untracked files are cached
+  separately for each way of reporting untracked dirs (collapsed or not) so
+  that commands that use different ones don't invalidate each other's. The
+  status of tracked files is cached too, for repos with an fsmonitor.
+  """
+
+  FILE = 'GL_STATUS_CACHE'
+  VERSION = 3
+  # A directory modified this close (in ns) to the moment we looked at it could
+  # be modified again without its mtime changing, so it's looked at next time
+  # again
+  RACY_NS = 1000000000
+
+  def __init__(self, gl_repo):
+    self.gl_repo = gl_repo
+    self._data = None
+    self._dirty = False
+    self._stamp = None
+    self._tracked_dirs = None
+
+  @property
+  def _fp(self):
+    return os.path.join(self.gl_repo.path, self.FILE)
+
+  def au_files(self, index_stamp):
+    """Returns the cached au files (or None if they are not in the cache)."""
+    return self._load(index_stamp).get('au')
+
+  def set_au_files(self, index_stamp, au_files):
+    self._load(index_stamp)['au'] = sorted(au_files)
+    self._dirty = True
+    self.save()
+
+  def status(self, collapse_untracked_dirs):
+    """Returns the status of the repo (like _git_status).
+
+    Untracked files (and the directories that have them) are taken from the
+    cache if they didn't change. If the repo has an fsmonitor, only the paths
+    it reports as changed are looked at.
+    """
+    git_repo = self.gl_repo.git_repo
+    data = self._load(self.gl_repo._index_stamp())
+    excludes = self._excludes_stamp()
+    head = None if git_repo.head_is_unborn else str(git_repo.head.target)
+    uts = data.setdefault('untracked', {})
+    mode = 'collapsed' if collapse_untracked_dirs else 'all'
+    ut = uts.get(mode)
+    if ut and ut['excludes'] != excludes:
+      ut = None
+
+    # We ask for the changes first so that the ones that happen while we look
+    # at the repo are reported next time
+    token, changed_paths = None, None
+    if self.gl_repo.fsmonitor:
+      with trace.span('fsmonitor') as attrs:
+        token, changed_paths = self.gl_repo.fsmonitor(
+            self.gl_repo.root,
+            ut['token'] if ut and ut['head'] == head else None)
+        attrs['changed'] = (
+            None if changed_paths is None else len(changed_paths))
+
+    if not ut:
+      with trace.span('status_cache.rebuild'):
+        # The directories with tracked files only change if the index changes
+        tracked_dirs = set([''])
+        for path in self.gl_repo._index_paths():
+          path = posixpath.dirname(path)
+          while path not in tracked_dirs:
+            tracked_dirs.add(path)
+            path = posixpath.dirname(path)
+        ut = uts[mode] = {
+            'collapse': collapse_untracked_dirs, 'excludes': excludes,
+            'tracked_dirs': sorted(tracked_dirs), 'dirs': {}, 'entries': {}}
+        self._tracked_dirs = tracked_dirs
+        git_status = self._scan_subtree(ut, '')
+        tracked = dict(
+            (path, st & ~pygit2.GIT_STATUS_WT_NEW)
+            for path, st in git_status.items()
+            if st != pygit2.GIT_STATUS_WT_NEW)
+    elif changed_paths is None or ut['head'] != head:
+      with trace.span('status_cache.refresh') as attrs:
+        attrs['dirs'], attrs['rescanned'] = len(ut['dirs']), self._refresh(ut)
+      tracked = self.gl_repo._git_status(include_untracked=False)
+    else:
+      with trace.span('status_cache.refresh') as attrs:
+        attrs['dirs'] = len(ut['dirs'])
+        attrs['rescanned'] = self._refresh(ut, changed_paths=changed_paths)
+      tracked = self._refresh_tracked(ut['tracked'], changed_paths)
+
+    if (ut.get('token') != token or ut.get('head') != head or
+        ut.get('tracked') != tracked):
+      ut['token'], ut['head'], ut['tracked'] = token, head, tracked
+      self._dirty = True
+    git_status = dict(tracked)
+    for path, st in ut['entries'].items():
+      git_status[path] = git_status.get(path, pygit2.GIT_STATUS_CURRENT) | st
+    return git_status
+
+  def tracked_status(self):
+    """Returns the status of the tracked files of the repo (like _git_status
+    with include_untracked=False).
+
+    If the repo has an fsmonitor, only the paths it reports as changed are
+    looked at, the status of the others is taken from the cache.
+    """
+    if not self.gl_repo.fsmonitor:
+      return self.gl_repo._git_status(include_untracked=False)
+
+    git_repo = self.gl_repo.git_repo
+    data = self._load(self.gl_repo._index_stamp())
+    head = None if git_repo.head_is_unborn else str(git_repo.head.target)
+    cached = data.get('tracked')
+    with trace.span('fsmonitor') as attrs:
+      token, changed_paths = self.gl_repo.fsmonitor(
+          self.gl_repo.root,
+          cached['token'] if cached and cached['head'] == head else None)
+      attrs['changed'] = None if changed_paths is None else len(changed_paths)
+    if changed_paths is None:
+      tracked = self.gl_repo._git_status(include_untracked=False)
+    else:
+      tracked = self._refresh_tracked(cached['tracked'], changed_paths)
+
+    new = {'token': token, 'head': head, 'tracked': tracked}
+    if cached != new:
+      data['tracked'] = new
+      self._dirty = True
+    return dict(tracked)
+
+  def save(self):
+    if not self._dirty:
+      return
+    tmp_fp = '{0}.{1}'.format(self._fp, os.getpid())
+    try:
+      with io.open(tmp_fp, mode='w', encoding='utf-8') as f:
+        json.dump(self._data, f)
+      os.replace(tmp_fp, self._fp)
+      self._stamp = _file_stamp(self._fp)
+    except (IOError, OSError):  # the cache is just an optimization
+      pass
+    self._dirty = False
+
+  def _load(self, index_stamp):
+    # Another process (e.g., a child of gl daemon) might have updated it
+    file_stamp = _file_stamp(self._fp)
+    if self._data is None or (not self._dirty and file_stamp != self._stamp):
+      self._stamp = file_stamp
+      try:
+        with io.open(self._fp, encoding='utf-8') as f:
+          self._data = json.load(f)
+      except (IOError, OSError, ValueError):
+        self._data = {}
+      self._tracked_dirs = None
+    if (self._data.get('version') != self.VERSION or
+        self._data.get('index') != index_stamp):
+      self._data = {'version': self.VERSION, 'index': index_stamp}
+      self._dirty = True
+      self._tracked_dirs = None
+    return self._data
+
+  def _refresh_tracked(self, tracked, changed_paths):
+    """Returns the status of the tracked files given their cached status and
+    the paths that changed since."""
+    changed = set(changed_paths)
+    def is_changed(path):
+      while path:
+        if path in changed:
+          return True
+        path = posixpath.dirname(path)
+      return False
+    ret = dict(
+        (path, st) for path, st in tracked.items() if not is_changed(path))
+    if changed_paths:
+      ret.update(_git_status(
+          self.gl_repo.git_repo, paths=changed_paths, include_untracked=False))
+    return ret
+
+  def _excludes_stamp(self):
+    try:
+      excludes_fp = self.gl_repo.config['core.excludesFile']
+    except KeyError:
+      excludes_fp = os.path.join(
+          os.environ.get('XDG_CONFIG_HOME') or os.path.join('~', '.config'),
+          'git', 'ignore')
+    excludes_fp = os.path.expanduser(excludes_fp)
+    return [
+        excludes_fp, _file_stamp(excludes_fp),
+        _file_stamp(os.path.join(self.gl_repo.path, 'info', 'exclude'))]
+
+  def _refresh(self, ut, changed_paths=None):
+    """Looks again at the directories that changed.
+
+    Args:
+      ut: the cache of untracked files.
+      changed_paths: if given, only the directories of these paths (and the
+        ones under them) are checked for changes. Otherwise all are.
+
+    Returns:
+      the number of directories looked at again.
+    """
+    dirs, root = ut['dirs'], self.gl_repo.root
+    if self._tracked_dirs is None:
+      self._tracked_dirs = set(ut['tracked_dirs'])
+    tracked_dirs = self._tracked_dirs
+
+    if changed_paths is None:
+      to_check = dirs
+    else:
+      to_check = set()
+      changed_dirs = []
+      for path in changed_paths:
+        parent = posixpath.dirname(path)
+        if parent in dirs:
+          to_check.add(parent)
+        if path in dirs:
+          to_check.add(path)
+          changed_dirs.append(path + '/')
+      if changed_dirs:
+        changed_dirs = tuple(changed_dirs)
+        to_check.update(d for d in dirs if d.startswith(changed_dirs))
+    # Changes in a directory without tracked files (and changes to a
+    # .gitignore) can change what's reported for the whole subtree so we look
+    # at the subtree again. For directories with tracked files, looking at
+    # what's directly in them is enough
+    subtrees = set()
+    changed = []
+    for d in to_check:
+      mtime, gitignore = dirs[d]
+      full_d = os.path.join(root, d)
+      try:
+        st = os.stat(full_d)
+      except OSError:
+        subtrees.add(d)
+        continue
+      if _file_stamp(os.path.join(full_d, '.gitignore')) != gitignore:
+        subtrees.add(d)
+      elif mtime is None or st.st_mtime_ns != mtime:
+        if d in tracked_dirs:
+          changed.append(d)
+        else:
+          subtrees.add(d)
+    if not subtrees and not changed:
+      return 0
+
+    self._dirty = True
+    # If a directory has no tracked files we look at the whole untracked
+    # directory it's in
+    roots = set()
+    for d in subtrees:
+      while d not in tracked_dirs:
+        parent = posixpath.dirname(d)
+        if parent in tracked_dirs:
+          break
+        d = parent
+      roots.add(d)
+
+    scanned = []
+    def in_scanned(d):
+      return any(not s or d == s or d.startswith(s + '/') for s in scanned)
+    for d in sorted(roots):  # parents go before their children
+      if not in_scanned(d):
+        self._scan_subtree(ut, d)
+        scanned.append(d)
+    changed = [d for d in changed if not in_scanned(d)]
+    for d in changed:
+      self._scan_dir(ut, d)
+    return len(scanned) + len(changed)
+
+  def _scan_dir(self, ut, d):
+    """Looks again at what's directly in the directory d (with tracked files).
+    """
+    dirs, entries = ut['dirs'], ut['entries']
+    git_repo = self.gl_repo.git_repo
+    index = self.gl_repo._read_index()
+    full_d = os.path.join(self.gl_repo.root, d)
+    prefix = d + '/' if d else ''
+
+    for path in [
+        path for path in entries if path.startswith(prefix) and
+        '/' not in path[len(prefix):]]:
+      del entries[path]
+    try:
+      dirs[d] = self._dir_record(full_d)
+      it = os.scandir(full_d)
+    except OSError:
+      dirs.pop(d, None)
+      return
+
+    new_dirs = []
+    with it:
+      for e in it:
+        path = prefix + e.name
+        if e.name == '.git' or path in dirs or _index_has(index, path):
+          continue
+        if e.is_dir(follow_symlinks=False):
+          if (path in self._tracked_dirs or
+              not git_repo.path_is_ignored(path)):
+            new_dirs.append(path)
+        elif ((e.is_file(follow_symlinks=False) or e.is_symlink()) and
+              not git_repo.path_is_ignored(path)):
+          # (like git, we skip sockets, fifos, etc)
+          entries[path] = pygit2.GIT_STATUS_WT_NEW
+    for path in new_dirs:
+      self._scan_subtree(ut, path)
+
+  def _scan_subtree(self, ut, d):
+    """Looks again at the directory d and all directories under it.
+
+    If d has no tracked files, it must be the top-most directory without
+    tracked files.
+
+    Returns:
+      the status of the files under d.
+    """
+    dirs, entries = ut['dirs'], ut['entries']
+    tracked_dirs = self._tracked_dirs
+    prefix = d + '/' if d else ''
+    for path in [path for path in dirs if path == d or path.startswith(prefix)]:
+      del dirs[path]
+    for path in [path for path in entries if path.startswith(prefix)]:
+      del entries[path]
+
+    # We record the mtime of each directory before looking into it so that if
+    # it's modified after we do, we'll notice
+    git_repo, root = self.gl_repo.git_repo, self.gl_repo.root
+    pending = [d]
+    while pending:
+      curr = pending.pop()
+      full_curr = os.path.join(root, curr)
+      try:
+        dirs[curr] = self._dir_record(full_curr)
+        it = os.scandir(full_curr)
+      except OSError:
+        dirs.pop(curr, None)
+        continue
+      with it:
+        subdirs = []
+        for e in it:
+          if e.name == '.git':
+            if curr:  # a nested repo, git doesn't go into it
+              subdirs = []
+              break
+            continue
+          if e.is_dir(follow_symlinks=False):
+            path = posixpath.join(curr, e.name)
+            if path in tracked_dirs or not git_repo.path_is_ignored(path):
+              subdirs.append(path)
+        pending.extend(subdirs)
+
+    if d and ut['collapse'] and d not in tracked_dirs:
+      # libgit2 doesn't report an untracked dir (that is not at the root) if
+      # it's given as the pathspec and it can't recurse into it, so we recurse
+      # and collapse its files ourselves
+      git_status = _git_status(git_repo, paths=[d])
+      if any(st & pygit2.GIT_STATUS_WT_NEW for st in git_status.values()):
+        entries[prefix] = pygit2.GIT_STATUS_WT_NEW
+      return git_status
+
+    if d:
+      git_status = _git_status(
+          git_repo, paths=[d], recurse_untracked_dirs=not ut['collapse'])
+    else:
+      git_status = self.gl_repo._git_status(
+          recurse_untracked_dirs=not ut['collapse'])
+    for path, st in git_status.items():
+      if st & pygit2.GIT_STATUS_WT_NEW:
+        entries[path] = pygit2.GIT_STATUS_WT_NEW
+    return git_status
+
+  def _dir_record(self, full_d):
+    st = os.stat(full_d)
+    mtime = st.st_mtime_ns
+    if mtime >= time.time_ns() - self.RACY_NS:
+      mtime = None
+    return [mtime, _file_stamp(os.path.join(full_d, '.gitignore'))]
+
+
+def _file_stamp(fp):
+  try:
+    st = os.stat(fp)
+  except OSError:
+    return None
+  return [st.st_mtime_ns, st.st_size]
+
+
+def _index_has(index, git_path):
+  """True if there's an entry (at any stage) for git_path in the index."""
+  return C.git_index_find(
+      ffi.NULL, index._index, git_path.encode('utf-8')) == 0
+
+
+def _git_status(
+    git_repo, paths=None, include_unmodified=False, include_untracked=True,
+    include_ignored=False, recurse_untracked_dirs=True, index=None):
+  """Like pygit2's Repository.status but it can be limited to some paths.
+
+  pygit2 doesn't let us give a pathspec to status so we do what libgit2's
+  status does (diff HEAD to the index and the index to the working directory)
+  ourselves.
+
+  Args:
+    git_repo: the pygit2 repository.
+    paths: if given, only the status of these paths (in git form, relative to
+      the repo root) is computed. Only the parts of the working directory that
+      contain them are visited.
+    include_unmodified: if True, tracked files that are not modified are also
+      reported (as GIT_STATUS_CURRENT).
+    include_untracked: if False, untracked files are not reported (and the
+      working directory is only looked at for tracked files).
+    include_ignored: if True, ignored files are also reported.
+    recurse_untracked_dirs: if False, a directory with no tracked files is
+      reported as a single untracked path ending in '/' (as libgit2 does).
+    index: the pygit2 Index to use. If not given, the repo's index is used
+      (and re-read if it changed on disk).
+
+  Returns:
+    a dict mapping paths to their git status flags.
+  """
+  if paths is not None and not paths:
+    return {}
+
+  flags = 0
+  if paths is not None:
+    # Match paths literally (and faster)
+    flags |= pygit2.GIT_DIFF_DISABLE_PATHSPEC_MATCH
+  if include_unmodified:
+    flags |= pygit2.GIT_DIFF_INCLUDE_UNMODIFIED
+  # (otherwise a file replaced by a symlink, or the other way around, is
+  # reported as deleted)
+  flags |= pygit2.GIT_DIFF_INCLUDE_TYPECHANGE
+  wt_flags = flags
+  if include_untracked:
+    wt_flags |= pygit2.GIT_DIFF_INCLUDE_UNTRACKED
+    if recurse_untracked_dirs:
+      wt_flags |= pygit2.GIT_DIFF_RECURSE_UNTRACKED_DIRS
+  if include_ignored:
+    wt_flags |= (
+        pygit2.GIT_DIFF_INCLUDE_IGNORED | pygit2.GIT_DIFF_RECURSE_IGNORED_DIRS)
+
+  if index is None:
+    index = git_repo.index
+    index.read(False)  # only if it changed on disk
+  head_tree = None if git_repo.head_is_unborn else git_repo.head.peel().tree
+
+  ret = {}
+  with _c_tree(head_tree) as c_tree:
+    index_diff = _diff(
+        git_repo, flags, paths,
+        lambda c_diff, c_opts: C.git_diff_tree_to_index(
+            c_diff, git_repo._repo, c_tree, index._index, c_opts))
+  for delta in index_diff.deltas:
+    if delta.status == pygit2.GIT_DELTA_CONFLICTED:
+      ret[delta.new_file.path] = pygit2.GIT_STATUS_CONFLICTED
+    else:
+      ret[delta.new_file.path] = _INDEX_DELTA_ST.get(
+          delta.status, pygit2.GIT_STATUS_CURRENT)
+
+  wt_diff = _diff(
+      git_repo, wt_flags, paths,
+      lambda c_diff, c_opts: C.git_diff_index_to_workdir(
+          c_diff, git_repo._repo, index._index, c_opts))
+  for delta in wt_diff.deltas:
+    path = delta.new_file.path
+    st = ret.get(path, pygit2.GIT_STATUS_CURRENT)
+    if (delta.status == pygit2.GIT_DELTA_CONFLICTED or
+        st == pygit2.GIT_STATUS_CONFLICTED):
+      ret[path] = pygit2.GIT_STATUS_CONFLICTED
+    else:
+      ret[path] = st | _WT_DELTA_ST.get(
+          delta.status, pygit2.GIT_STATUS_CURRENT)
+  return ret
+
+def _split(weighted, n):
+  """Splits the (item, weight) pairs in weighted into at most n contiguous
+  shards of about the same weight.
+
+  Returns:
+    a list with the items of each shard.
+  """
+  target = sum(w for _, w in weighted) / n
+  shards = []
+  curr, curr_weight = [], 0
+  for item, w in weighted:
+    if curr and curr_weight + w / 2 > target and len(shards) < n - 1:
+      shards.append(curr)
+      curr, curr_weight = [], 0
+    curr.append(item)
+    curr_weight += w
+  if curr:
+    shards.append(curr)
+  return shards
+
+# How much of a file we look at to tell if it's binary (as git does, a file is
+# binary if there's a NUL in there)
+_BINARY_SNIFF_SIZE = 8000
+
+def _skip_diff(git_repo, full_path, git_path, threshold):
+  """Tells whether the working version of a file shouldn't be diffed.
+
+  Only the size and the first few bytes of the file are looked at.
+
+  Returns:
+    None if the file should be diffed (or doesn't exist), (True, size) if it
+    is larger than threshold and (False, size) if it looks binary.
+  """
+  try:
+    st = os.lstat(full_path)
+    if not stat.S_ISREG(st.st_mode):  # git stores the target of symlinks
+      return None
+    if st.st_size > threshold:
+      return True, st.st_size
+    with io.open(full_path, mode='rb') as f:
+      if b'\0' not in f.read(_BINARY_SNIFF_SIZE):
+        return None
+  except (IOError, OSError):
+    return None  # the diff deals with it
+  # The diff attribute can say that the file is text
+  if git_repo.get_attr(git_path, 'diff') is True:
+    return None
+  return False, st.st_size
+
+def _object_sizes(ids, cwd):
+  """Returns the sizes of the objects with the given ids (without reading
+  them)."""
+  out = git(
+      'cat-file', '--batch-check=%(objectsize)', cwd=cwd,
+      _in=''.join('{0}\n'.format(i) for i in ids))
+  return [int(size) for size in out.splitlines()]
+
+def _read_wd_file(full_path):
+  """Returns the contents of the file at full_path (as git would store them in
+  a blob, but without applying any filters).
+
+  Raises:
+    KeyError: if the file doesn't exist.
+  """
+  try:
+    if os.path.islink(full_path):  # git stores the target
+      return os.fsencode(os.readlink(full_path))
+    with io.open(full_path, mode='rb') as f:
+      return f.read()
+  except (IOError, OSError) as e:
+    if e.errno in (errno.ENOENT, errno.ENOTDIR):
+      raise KeyError(full_path)
+    raise
+
+class _BufferPatch(object):
+  """The pygit2 Patch of a new file with the given contents.
+
+  The lines of a patch created out of a buffer point into the buffer, but
+  pygit2 doesn't keep it alive, so we do (as long as this object is around).
+  Attribute access is forwarded to the Patch.
+  """
+
+  def __init__(self, contents, path):
+    self._contents = contents
+    self._patch = pygit2.Patch.create_from(None, contents, path, path)
+
+  def __getattr__(self, name):
+    return getattr(self._patch, name)
+
+class _DiffView(object):
+  """The pygit2 Diff with only the deltas at the given positions.
+
+  Only len, iteration (over the patches) and indexing take the positions into
+  account. Other attribute access is forwarded to the Diff.
+  """
+
+  def __init__(self, diff, positions):
+    self._diff = diff
+    self._positions = positions
+
+  def __len__(self):
+    return len(self._positions)
+
+  def __iter__(self):
+    for i in self._positions:
+      yield self._diff[i]
+
+  def __getitem__(self, i):
+    return self._diff[self._positions[i]]
+
+  def __getattr__(self, name):
+    return getattr(self._diff, name)
+
+@contextlib.contextmanager
+def _c_tree(tree):
+  """Yields the git_tree * of the pygit2 Tree (NULL, the empty tree, if tree is
+  None).
+
+  The pointer is only valid inside the with block: libgit2 doesn't cache big
+  trees, so the git_tree is freed as soon as the pygit2 Tree is. Holding tree
+  here keeps it alive for as long as the pointer can be used.
+  """
+  if tree is None:
+    yield ffi.NULL
+    return
+  c_tree = ffi.new('git_tree **')
+  ffi.buffer(c_tree)[:] = tree._pointer[:]
+  yield c_tree[0]
+
+def _tree_index(git_repo, tree, paths):
+  """Returns an in-memory index with the entries of tree under paths."""
+  index = pygit2.Index()
+  def add(entry, path):
+    if entry.type_str == 'tree':
+      for child in git_repo[entry.id]:
+        add(child, path + '/' + child.name)
+    else:
+      index.add(pygit2.IndexEntry(path, entry.id, entry.filemode))
+  for path in paths:
+    try:
+      entry = tree[path]
+    except KeyError:  # not in tree
+      continue
+    add(entry, path)
+  return index
+
+def _find_renames(diff, config):
+  try:
+    rename_limit = config.get_int('diff.renameLimit')
+  except (KeyError, ValueError):
+    rename_limit = 1000
+  diff.find_similar(
+      flags=pygit2.GIT_DIFF_FIND_RENAMES, rename_limit=rename_limit)
+
+def _diff(git_repo, flags, paths, diff_fn, max_size=0):
+  """Runs the libgit2 diff function diff_fn with the given flags and paths.
+
+  Files larger than max_size (in bytes) are considered binary (and are not
+  loaded). 0 means libgit2's default (512 MiB).
+
+  Returns:
+    the pygit2 Diff.
+  """
+  c_opts = ffi.new('git_diff_options *')
+  check_error(C.git_diff_init_options(c_opts, 1))
+  c_opts.flags = flags
+  c_opts.max_size = max_size
+  c_diff = ffi.new('git_diff **')
+  with StrArray(paths) as pathspec:
+    if paths is not None:
+      c_opts.pathspec = pathspec[0]
+    check_error(diff_fn(c_diff, c_opts))
+  return pygit2.Diff.from_c(bytes(ffi.buffer(c_diff)[:]), git_repo)
+
+
 # Misc
 
 OpCb = collections.namedtuple(
@@ -1363,16 +2622,76 @@ def git(*args, cwd=None, _in=None):
   return git_p(*args, cwd=cwd, _in=_in).stdout
 
 def git_p(*args, cwd=None, _in=None):
-  p = run(
-    ['git', '--no-pager', *args], check=True, capture_output=True, cwd=cwd,
-    input=_in, encoding=ENCODING)
+  with trace.span(
+      'git ' + args[0], argv=list(args), cwd=cwd or os.getcwd()) as attrs:
+    p = run(
+      ['git', '--no-pager', *args], check=True, capture_output=True, cwd=cwd,
+      input=_in, encoding=ENCODING)
+    attrs['out'] = len(p.stdout)
   return p
 
-def walker(git_repo, target, reverse):
-  flags = pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_TIME
+# The flag git sets on index entries of files marked as assumed unchanged
+# (GIT_INDEX_ENTRY_VALID in libgit2)
+_INDEX_ENTRY_VALID = 0x8000
+
+def _index_paths(index_fp, au_only=False):
+  """Returns the paths of the entries in the index.
+
+  Reading the index file ourselves is faster than iterating over the entries
+  with libgit2. Only versions 2 and 3 of the index format are supported (None
+  is returned for others).
+
+  Args:
+    index_fp: the path of the index file.
+    au_only: if True, only the paths of the entries marked as assumed
+      unchanged are returned.
+  """
+  with io.open(index_fp, mode='rb') as f:
+    data = f.read()
+  signature, version, entries_qty = struct.unpack_from('!4sII', data)
+  if signature != b'DIRC' or version not in (2, 3):
+    return None
+
+  # Each entry has 60 bytes of stat data and object id followed by 2 bytes of
+  # flags (and 2 more if it's an extended entry), the path and 1-8 NULs so
+  # that its size is a multiple of 8. The flags' high bits are assume valid,
+  # extended and stage (2 bits), the rest is the length of the path (0xfff if
+  # it's longer than that)
+  paths = []
+  pos = 12  # the header is 12 bytes long
+  for _ in range(entries_qty):
+    flags = data[pos + 60]  # the high byte
+    path_len = ((flags & 0x0f) << 8) | data[pos + 61]
+    path_pos = pos + (64 if flags & 0x40 else 62)
+    if path_len == 0xfff:
+      path_len = data.index(b'\0', path_pos) - path_pos
+    if not au_only or flags & 0x80:
+      paths.append(data[path_pos:path_pos + path_len].decode('utf-8'))
+    pos += (path_pos - pos + path_len + 8) & ~7
+  return paths
+
+def _update_index(flag, paths, cwd):
+  """Runs git update-index with the given flag on all paths at once."""
+  git(
+      'update-index', flag, '-z', '--stdin', cwd=cwd,
+      _in=''.join(p + '\0' for p in paths))
+
+def walker(git_repo, target, reverse, topological=True):
+  """Walks the history of target (newest commits first unless reverse).
+
+  If topological is False, commits are in the order the walk reaches them by
+  following parents from target: each one comes after a child of it, but
+  possibly before some of its other children, and not in date order. libgit2
+  can only sort (topologically or by date) after walking the whole history, so
+  this is the only order in which the first commits are returned right away.
+  """
+  if topological:
+    flags = pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_TIME
+  else:
+    flags = pygit2.GIT_SORT_NONE
   if reverse:
     flags = flags | pygit2.GIT_SORT_REVERSE
-  return git_repo.walk(target, flags)
+  return trace.iterate('pygit2.walk', git_repo.walk(target, flags))
 
 def _get_git_path(path):
   return path if sys.platform != 'win32' else path.replace('\\', '/')
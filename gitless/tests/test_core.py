@@ -6,6 +6,7 @@
 
 
 from functools import wraps
+import json
 import os
 import shutil
 import tempfile
@@ -14,8 +15,8 @@ import argparse
 import sys
 from subprocess import CalledProcessError
 
-from gitless import core
-from gitless.cli import gl, helpers, gl_track
+from gitless import core, watcher
+from gitless.cli import completion, gl, helpers, gl_track
 import gitless.tests.utils as utils_lib
 
 
@@ -229,6 +230,18 @@ class TestFileTrack(TestFile):
         os.path.relpath(UNTRACKED_DIR_DIR_FP, DIR_DIR),
         os.path.relpath(UNTRACKED_DIR_DIR_FP_WITH_SPACE, DIR_DIR))
 
+  def test_track_untracked_dir(self):
+    new_fps = [
+        os.path.join('new_dir', 'f1'), os.path.join('new_dir', 'sub', 'f2')]
+    for fp in new_fps:
+      utils_lib.write_file(fp)
+    self.curr_b.track_file('new_dir')
+    for fp in new_fps:
+      self.assertEqual(
+          core.GL_STATUS_TRACKED, self.curr_b.status_file(fp).type)
+    self.assertRaisesRegexp(
+        ValueError, 'no untracked files', self.curr_b.track_file, 'new_dir')
+
   def __assert_track_tracked(self, *fps):
     root = self.repo.root
     for fp in fps:
@@ -477,6 +490,269 @@ class TestFileStatus(TestFile):
     for f_st in self.curr_b.status():
       self.assertEqual(f_st, self.curr_b.status_file(f_st.fp))
 
+  def test_status_files_equivalence(self):
+    self.curr_b.untrack_file(TRACKED_DIR_FP)
+    self.curr_b.track_file(UNTRACKED_DIR_DIR_FP)
+    os.remove(TRACKED_FP_WITH_SPACE)
+    fps = ALL_FPS_IN_WD + [NONEXISTENT_FP, NONEXISTENT_FP_WITH_SPACE]
+    st = self.curr_b.status_files(fps)
+    for fp in fps:
+      try:
+        expected = self.curr_b.status_file(fp)
+      except KeyError:
+        self.assertFalse(fp in st, fp)
+      else:
+        self.assertEqual(expected, st[fp])
+
+  def test_status_paths(self):
+    self.curr_b.untrack_file(TRACKED_DIR_FP)
+    self.curr_b.track_file(UNTRACKED_DIR_DIR_FP)
+    os.remove(TRACKED_DIR_DIR_FP)
+    utils_lib.write_file(TRACKED_FP, contents='contents')
+    st_all = list(self.curr_b.status())
+    for paths in ([DIR], [DIR_DIR], [TRACKED_FP, DIR_DIR + os.sep]):
+      expected = sorted(
+          f for f in st_all
+          if any(f.fp == p.rstrip(os.sep) or f.fp.startswith(
+              p.rstrip(os.sep) + os.sep) for p in paths))
+      self.assertTrue(expected)
+      self.assertEqual(expected, sorted(self.curr_b.status(paths=paths)))
+    self.assertEqual(sorted(st_all), sorted(self.curr_b.status(paths=['.'])))
+
+  def test_status_collapse_untracked_dirs(self):
+    new_fps = [
+        os.path.join('new_dir', 'f1'), os.path.join('new_dir', 'sub', 'f2')]
+    for fp in new_fps:
+      utils_lib.write_file(fp)
+    st_all = list(self.curr_b.status())
+    st = list(self.curr_b.status(collapse_untracked_dirs=True))
+    self.assertIn(
+        self.curr_b.FileStatus(
+            'new_dir/', core.GL_STATUS_UNTRACKED, False, True, True, False),
+        st)
+    collapsed = [f.fp for f in st if f.fp.endswith('/')]
+    self.assertEqual(
+        sorted(f for f in st_all
+               if not any(f.fp.startswith(d) for d in collapsed)),
+        sorted(f for f in st if f.fp not in collapsed))
+    # Paths under the untracked dir are still reported
+    sub = os.path.join('new_dir', 'sub')
+    self.assertEqual(
+        [new_fps[1]], [f.fp for f in self.curr_b.status(
+            paths=[sub], collapse_untracked_dirs=True)])
+
+  def test_status_cache(self):
+    # We set the mtimes of dirs ourselves (to some time in the past) so that
+    # they are not considered racy
+    mtimes = iter(range(10 ** 18, 2 * 10 ** 18, 10 ** 9))
+    def changed(*dirs):
+      for d in dirs:
+        mtime = next(mtimes)
+        os.utime(d, ns=(mtime, mtime))
+
+    def assert_status(collapse):
+      st = sorted(self.curr_b.status(collapse_untracked_dirs=collapse))
+      self.repo.config['gitless.statusCache'] = False
+      try:
+        expected = sorted(
+            self.curr_b.status(collapse_untracked_dirs=collapse))
+      finally:
+        del self.repo.config['gitless.statusCache']
+      self.assertEqual(expected, st)
+
+    new_fp = os.path.join(DIR, 'new')
+    new_dir_fp = os.path.join('new_dir', 'sub', 'f')
+    for collapse in (False, True):
+      changed(*[d for d, _, _ in os.walk('.') if '.git' not in d])
+      assert_status(collapse)
+      self.assertTrue(
+          os.path.exists(os.path.join(self.repo.path, 'GL_STATUS_CACHE')))
+      assert_status(collapse)
+
+      utils_lib.write_file(new_fp)
+      changed(DIR)
+      assert_status(collapse)
+      utils_lib.write_file(new_dir_fp)
+      changed('.', 'new_dir', os.path.dirname(new_dir_fp))
+      assert_status(collapse)
+      utils_lib.write_file(os.path.join('new_dir', 'sub', 'g'))
+      changed(os.path.dirname(new_dir_fp))
+      assert_status(collapse)
+      utils_lib.write_file(os.path.join(DIR, '.gitignore'), contents='new')
+      changed(DIR)
+      assert_status(collapse)
+
+      os.remove(os.path.join(DIR, '.gitignore'))
+      os.remove(new_fp)
+      changed(DIR)
+      assert_status(collapse)
+      shutil.rmtree('new_dir')
+      changed('.')
+      assert_status(collapse)
+
+  def test_status_cache_modes(self):
+    # (so that dirs are not considered racy, see test_status_cache)
+    for d, _, _ in os.walk('.'):
+      if '.git' not in d.split(os.sep):
+        os.utime(d, ns=(10 ** 18, 10 ** 18))
+    cache = self.repo._status_cache
+    scans = []
+    scan_subtree = cache._scan_subtree
+    def counting_scan_subtree(ut, d):
+      scans.append(d)
+      return scan_subtree(ut, d)
+    cache._scan_subtree = counting_scan_subtree
+
+    # Asking for the other way of reporting untracked dirs doesn't throw away
+    # what's cached for the first one
+    st = {}
+    for collapse in (True, False):
+      st[collapse] = sorted(self.curr_b.status(collapse_untracked_dirs=collapse))
+    self.assertEqual([''] * 2, scans)
+    for collapse in (True, False, True, False):
+      self.assertEqual(
+          st[collapse],
+          sorted(self.curr_b.status(collapse_untracked_dirs=collapse)))
+    self.assertEqual([''] * 2, scans)
+
+  def test_status_table(self):
+    utils_lib.write_file(TRACKED_FP, contents='contents')
+    os.remove(TRACKED_FP_WITH_SPACE)
+    st = self.curr_b.status_table()
+    files = list(st)
+    self.assertEqual(sorted(self.curr_b.status()), files)
+    self.assertEqual(len(files), len(st))
+    self.assertEqual([f.fp for f in files], list(st.fps()))
+
+    tracked_mod = st.filter(type=core.GL_STATUS_TRACKED, modified=True)
+    self.assertEqual(
+        [f for f in files if f.type == core.GL_STATUS_TRACKED and f.modified],
+        list(tracked_mod))
+    self.assertEqual(
+        [TRACKED_FP, TRACKED_FP_WITH_SPACE], list(tracked_mod.fps()))
+    self.assertFalse(list(tracked_mod)[1].exists_in_wd)
+    self.assertEqual(
+        [f for f in files if f.type == core.GL_STATUS_UNTRACKED],
+        list(st.filter(type=core.GL_STATUS_UNTRACKED)))
+    self.assertEqual(
+        0, len(tracked_mod.filter(type=core.GL_STATUS_UNTRACKED)))
+
+    for use_cache in (False, True):
+      self.repo.config['gitless.statusCache'] = use_cache
+      self.assertEqual(
+          [f for f in files if f.type != core.GL_STATUS_UNTRACKED],
+          list(self.curr_b.status_table(include_untracked=False)))
+      self.assertEqual(
+          [f for f in files if f.type != core.GL_STATUS_UNTRACKED and
+           f.fp.startswith(DIR + '/')],
+          list(self.curr_b.status_table(paths=[DIR], include_untracked=False)))
+
+  def test_status_threads(self):
+    utils_lib.write_file(os.path.join('new_dir', 'sub', 'f'))
+    utils_lib.write_file(TRACKED_FP, contents='contents')
+    def status(collapse):
+      return sorted(self.curr_b.status(collapse_untracked_dirs=collapse))
+
+    for use_cache in (False, True):
+      self.repo.config['gitless.statusCache'] = use_cache
+      for collapse in (False, True):
+        expected = status(collapse)
+        for threads in (0, 2, 3, 100):
+          self.repo.config['gitless.statusThreads'] = threads
+          self.assertEqual(expected, status(collapse))
+          if use_cache:  # see that it's the same if it's rebuilt
+            os.remove(os.path.join(self.repo.path, 'GL_STATUS_CACHE'))
+            self.assertEqual(expected, status(collapse))
+          del self.repo.config['gitless.statusThreads']
+
+  def test_status_fsmonitor(self):
+    reported = []
+    def fsmonitor(root, token):
+      self.assertEqual(self.repo.root, root)
+      if token is None:
+        return 't1', None
+      ret = list(reported)
+      del reported[:]
+      return 't1', ret
+    self.repo.fsmonitor = fsmonitor
+
+    def status():
+      return dict(
+          (f.fp, (f.type, f.modified)) for f in self.curr_b.status())
+
+    st = status()
+    utils_lib.write_file(TRACKED_FP, contents='contents')
+    utils_lib.write_file(os.path.join(DIR, 'new'))
+    reported.extend([TRACKED_FP, DIR])
+    new_st = status()
+    self.assertEqual((core.GL_STATUS_TRACKED, True), new_st[TRACKED_FP])
+    self.assertEqual(core.GL_STATUS_UNTRACKED, new_st[DIR + '/new'][0])
+
+    # Paths the fsmonitor doesn't report are not looked at
+    utils_lib.write_file(UNTRACKED_FP, contents='contents')
+    os.remove(os.path.join(DIR, 'new'))
+    self.assertEqual(new_st, status())
+    reported.extend([UNTRACKED_FP, DIR])
+    new_st.pop(DIR + '/new')
+    self.assertEqual(new_st, status())
+
+    # Without an fsmonitor everything is looked at
+    self.repo.fsmonitor = None
+    utils_lib.write_file(TRACKED_FP, contents=TRACKED_FP_CONTENTS_2)
+    self.assertEqual(st, status())
+
+  def test_status_fsmonitor_tracked_only(self):
+    changes = []
+    def fsmonitor(root, token):
+      if token is None:
+        return len(changes), None
+      return len(changes), changes[token:]
+    self.repo.fsmonitor = fsmonitor
+
+    def status():
+      return dict(
+          (f.fp, f.modified)
+          for f in self.curr_b.status(include_untracked=False))
+
+    st = status()
+    self.assertFalse(st)
+    utils_lib.write_file(TRACKED_FP, contents='contents')
+    utils_lib.write_file(TRACKED_DIR_FP, contents='contents')
+    changes.append(TRACKED_FP)
+    # Paths the fsmonitor doesn't report are not looked at
+    self.assertEqual({TRACKED_FP: True}, status())
+    changes.append(DIR)
+    self.assertEqual({TRACKED_FP: True, TRACKED_DIR_FP: True}, status())
+    # The untracked files are still looked for if asked for
+    self.assertIn(UNTRACKED_FP, [f.fp for f in self.curr_b.status()])
+
+    # Without an fsmonitor everything is looked at
+    self.repo.fsmonitor = None
+    utils_lib.write_file(TRACKED_FP, contents=TRACKED_FP_CONTENTS_2)
+    self.assertEqual({TRACKED_DIR_FP: True}, status())
+
+  def test_status_typechange(self):
+    if sys.platform == 'win32':
+      return  # no symlinks
+    os.remove(TRACKED_FP)
+    os.symlink(TRACKED_DIR_FP, TRACKED_FP)
+    expected = self.curr_b.FileStatus(
+        TRACKED_FP, core.GL_STATUS_TRACKED, True, True, True, False)
+    self.assertEqual(expected, self.curr_b.status_file(TRACKED_FP))
+    for use_cache in (False, True):
+      self.repo.config['gitless.statusCache'] = use_cache
+      for threads in (1, 2):
+        self.repo.config['gitless.statusThreads'] = threads
+        for collapse in (False, True):
+          st = self.curr_b.status_table(collapse_untracked_dirs=collapse)
+          self.assertIn(expected, list(st))
+        self.assertIn(expected, list(
+            self.curr_b.status_table(paths=[TRACKED_FP])))
+        self.assertIn(expected, list(
+            self.curr_b.status_table(include_untracked=False)))
+    # (diff shows it as modified too)
+    self.assertEqual(1, self.curr_b.diff_file(TRACKED_FP).line_stats[1])
+
   def test_status_nonexistent_fp(self):
     self.assertRaises(KeyError, self.curr_b.status_file, NONEXISTENT_FP)
     self.assertRaises(
@@ -513,6 +789,9 @@ class TestFileStatus(TestFile):
 
     os.remove(UNTRACKED_FP)
     self.assertRaises(KeyError, self.curr_b.status_file, UNTRACKED_FP)
+    self.assertFalse(UNTRACKED_FP in self.curr_b.status_files([UNTRACKED_FP]))
+    self.assertFalse(
+        any(f.fp == UNTRACKED_FP for f in self.curr_b.status()))
 
   def test_status_track_untrack(self):
     self.curr_b.track_file(UNTRACKED_FP)
@@ -563,6 +842,19 @@ class TestFileStatus(TestFile):
     self.assertFalse(st.exists_in_wd)
     self.assertTrue(st.exists_at_head)
 
+  def test_status_untrack_index_versions(self):
+    self.curr_b.untrack_file(TRACKED_FP)
+    self.curr_b.untrack_file(TRACKED_DIR_FP_WITH_SPACE)
+    # Extended entries (version 3) and prefix-compressed paths (version 4)
+    utils_lib.git('update-index', '--skip-worktree', TRACKED_DIR_DIR_FP)
+    for version in ('3', '4'):
+      utils_lib.git('update-index', '--index-version', version)
+      untracked_au = [
+          f_st.fp for f_st in self.curr_b.status()
+          if f_st.type == core.GL_STATUS_UNTRACKED and f_st.exists_at_head]
+      self.assertEqual(
+          sorted([TRACKED_FP, TRACKED_DIR_FP_WITH_SPACE]), untracked_au)
+
   def test_status_ignore_tracked(self):
     """Assert that ignoring a tracked file has no effect."""
     utils_lib.append_to_file('.gitignore', contents='\n' + TRACKED_FP + '\n')
@@ -588,6 +880,44 @@ class TestFileStatus(TestFile):
             fp, field, expected, field, got))
 
 
+@unittest.skipUnless(watcher.is_supported(), 'inotify is not available')
+class TestWatcher(TestFile):
+
+  def setUp(self):
+    super(TestWatcher, self).setUp()
+    self.watcher = watcher.Watcher(self.repo.root)
+    self.addCleanup(self.watcher.close)
+
+  def test_changes_since(self):
+    token, paths = self.watcher.changes_since(None)
+    self.assertIsNone(paths)
+    token, paths = self.watcher.changes_since(token)
+    self.assertEqual([], paths)
+
+    utils_lib.write_file(TRACKED_FP, contents='contents')
+    utils_lib.write_file(os.path.join('new_dir', 'f'))
+    token, paths = self.watcher.changes_since(token)
+    # The new dir is reported (its files might be too, depending on whether
+    # they were created before it was watched)
+    self.assertEqual([TRACKED_FP, 'new_dir'], paths[:2])
+    # Files in new dirs are also watched
+    utils_lib.write_file(os.path.join('new_dir', 'f'), contents='contents')
+    token, paths = self.watcher.changes_since(token)
+    self.assertEqual(['new_dir/f'], paths)
+
+  def test_changes_since_ignores_git_dir(self):
+    token, _ = self.watcher.changes_since(None)
+    utils_lib.write_file(os.path.join(REPO_DIR, 'new'))
+    self.assertEqual([], self.watcher.changes_since(token)[1])
+
+  def test_changes_since_invalid_token(self):
+    token, _ = self.watcher.changes_since(None)
+    utils_lib.write_file(TRACKED_FP, contents='contents')
+    self.assertIsNone(self.watcher.changes_since('invalid')[1])
+    self.assertIsNone(self.watcher.changes_since('0:0')[1])
+    self.assertEqual([TRACKED_FP], self.watcher.changes_since(token)[1])
+
+
 class TestFileDiff(TestFile):
 
   @assert_status_unchanged(
@@ -611,6 +941,140 @@ class TestFileDiff(TestFile):
       self.assertEqual('+', hunk.lines[0].origin)
       self.assertEqual('new contents', hunk.lines[0].content)
 
+  def test_diff_no_objects_written(self):
+    def objects():
+      return sorted(
+          fp for _, _, fps in os.walk(os.path.join(REPO_DIR, 'objects'))
+          for fp in fps)
+
+    before = objects()
+    utils_lib.write_file(TRACKED_FP, contents='new contents')
+    utils_lib.write_file(UNTRACKED_FP, contents='new contents')
+    utils_lib.write_file(IGNORED_FP, contents='new contents')
+    os.remove(TRACKED_FP_WITH_SPACE)
+    for fp in (TRACKED_FP, UNTRACKED_FP, IGNORED_FP, TRACKED_FP_WITH_SPACE):
+      patch = self.curr_b.diff_file(fp)
+      self.assertTrue(patch.line_stats[1] or patch.line_stats[2])
+    self.assertEqual(before, objects())
+
+  def test_diff_files(self):
+    utils_lib.write_file(TRACKED_FP, contents='new contents')
+    utils_lib.write_file(UNTRACKED_FP, contents='new contents')
+    os.remove(TRACKED_FP_WITH_SPACE)
+    fps = [
+        UNTRACKED_FP, TRACKED_FP_WITH_SPACE, NONEXISTENT_FP, TRACKED_FP,
+        os.path.join(DIR, 'file')]
+    utils_lib.write_file(fps[-1])
+
+    def lines(patch):
+      return [
+          (l.origin, l.content) for hunk in patch.hunks for l in hunk.lines]
+
+    patches = list(self.curr_b.diff_files(fps))
+    self.assertEqual(fps, [fp for fp, _ in patches])
+    for fp, patch in patches:
+      if fp == NONEXISTENT_FP:
+        self.assertIsNone(patch)
+        continue
+      expected = self.curr_b.diff_file(fp)
+      self.assertEqual(expected.line_stats, patch.line_stats)
+      self.assertEqual(lines(expected), lines(patch))
+    self.assertEqual([], list(self.curr_b.diff_files([])))
+
+  def test_diff_skipped(self):
+    big_contents = 'big file contents\n'
+    utils_lib.git('config', 'core.bigFileThreshold', str(len(big_contents) - 1))
+    utils_lib.write_file(TRACKED_FP, contents=big_contents)
+    utils_lib.write_file(UNTRACKED_FP, contents='bin\0')
+    utils_lib.write_file(TRACKED_DIR_FP, contents='small\n')
+    self.assertEqual(
+        [(TRACKED_FP, self.curr_b.SkippedDiff(
+            TRACKED_FP, True, len(TRACKED_FP_CONTENTS_2), len(big_contents))),
+         (UNTRACKED_FP, self.curr_b.SkippedDiff(UNTRACKED_FP, False, None, 4))],
+        list(self.curr_b.diff_files([TRACKED_FP, UNTRACKED_FP])))
+    patch = self.curr_b.diff_file(TRACKED_DIR_FP)
+    self.assertEqual((0, 1, 1), patch.line_stats)
+
+    # The committed version can be the large one
+    utils_lib.git('commit', '-m', 'big', TRACKED_FP)
+    utils_lib.write_file(TRACKED_FP, contents='small\n')
+    self.assertEqual(
+        self.curr_b.SkippedDiff(TRACKED_FP, True, len(big_contents), 6),
+        self.curr_b.diff_file(TRACKED_FP))
+    os.remove(TRACKED_FP)
+    self.assertEqual(
+        self.curr_b.SkippedDiff(TRACKED_FP, True, len(big_contents), None),
+        self.curr_b.diff_file(TRACKED_FP))
+
+    # The diff attribute can say that a file is text
+    utils_lib.write_file(TRACKED_DIR_FP, contents='bin\0\n')
+    self.assertIsInstance(
+        self.curr_b.diff_file(TRACKED_DIR_FP), self.curr_b.SkippedDiff)
+    utils_lib.write_file(
+        '.gitattributes', contents=os.path.basename(TRACKED_DIR_FP) + ' diff\n')
+    patch = self.curr_b.diff_file(TRACKED_DIR_FP)
+    self.assertEqual((0, 1, 1), patch.line_stats)
+
+  def test_diff_commits(self):
+    head = self.repo.revparse_single('HEAD')
+    prev = self.repo.revparse_single('HEAD^')
+    def paths(diff):
+      return [patch.delta.new_file.path for patch in diff]
+
+    all_paths = paths(self.curr_b.diff_commits(prev, head))
+    self.assertEqual(6, len(all_paths))
+    self.assertEqual(
+        [p for p in all_paths if p.startswith(DIR_DIR + '/')],
+        paths(self.curr_b.diff_commits(prev, head, paths=[DIR_DIR])))
+    diff = self.curr_b.diff_commits(prev, head, paths=[TRACKED_FP])
+    self.assertEqual([TRACKED_FP], paths(diff))
+    self.assertEqual((0, 1, 1), diff[0].line_stats)
+    self.assertEqual(
+        [], paths(self.curr_b.diff_commits(prev, head, paths=[UNTRACKED_FP])))
+
+  def test_diff_wd(self):
+    head = self.repo.revparse_single('HEAD')
+    prev = self.repo.revparse_single('HEAD^')
+    utils_lib.write_file(TRACKED_FP, contents=TRACKED_FP_CONTENTS_1)
+    self.assertEqual(
+        [], list(self.curr_b.diff_wd(prev, paths=[TRACKED_FP])))
+    [patch] = self.curr_b.diff_wd(head, paths=[TRACKED_FP])
+    self.assertEqual((0, 1, 1), patch.line_stats)
+
+    os.rename(TRACKED_DIR_FP, 'renamed')
+    self.curr_b.track_file('renamed')
+    diff = self.curr_b.diff_wd(head, paths=[TRACKED_DIR_FP, 'renamed'])
+    self.assertEqual(
+        [('D', TRACKED_DIR_FP), ('A', 'renamed')],
+        [(p.delta.status_char(), p.delta.new_file.path) for p in diff])
+    diff = self.curr_b.diff_wd(
+        head, paths=[TRACKED_DIR_FP, 'renamed'], find_renames=True)
+    self.assertEqual(
+        [('R', TRACKED_DIR_FP, 'renamed')],
+        [(p.delta.status_char(), p.delta.old_file.path, p.delta.new_file.path)
+         for p in diff])
+
+  def test_diff_big_root_tree(self):
+    # libgit2 doesn't cache trees bigger than 4 KiB, so these only work if
+    # the tree is kept alive while the diff uses it
+    fps = ['root_file_{0:03}'.format(i) for i in range(400)]
+    for fp in fps:
+      utils_lib.write_file(fp, contents=fp + '\n')
+    utils_lib.git('add', *fps)
+    utils_lib.git('commit', '-m', 'big root tree')
+    head = self.repo.revparse_single('HEAD')
+    prev = self.repo.revparse_single('HEAD^')
+    self.assertLess(4096, len(head.tree.read_raw()))
+    utils_lib.write_file(fps[0], contents='new contents\n')
+    for _ in range(10):
+      st = {f.fp: f for f in self.curr_b.status()}
+      self.assertTrue(st[fps[0]].modified)
+      self.assertNotIn(fps[1], st)
+      self.assertTrue(self.curr_b.status_file(fps[0]).modified)
+      self.assertEqual(
+          len(fps), len(self.curr_b.diff_commits(prev, head, paths=fps)))
+      self.assertEqual(1, len(self.curr_b.diff_wd(head, paths=fps)))
+
   def test_diff_nonexistent_fp(self):
     self.assertRaises(KeyError, self.curr_b.diff_file, NONEXISTENT_FP)
     self.assertRaises(
@@ -767,6 +1231,14 @@ class TestFileResolve(TestFile):
   def test_resolve_fp_with_conflicts(self):
     self.__assert_resolve_fp(FP_IN_CONFLICT, DIR_FP_IN_CONFLICT)
 
+  def test_status_files_in_conflict(self):
+    fps = [FP_IN_CONFLICT, DIR_FP_IN_CONFLICT, TRACKED_FP]
+    st = self.curr_b.status_files(fps)
+    for fp in fps:
+      self.assertEqual(self.curr_b.status_file(fp), st[fp])
+    self.assertTrue(st[FP_IN_CONFLICT].in_conflict)
+    self.assertFalse(st[TRACKED_FP].in_conflict)
+
   def test_resolve_relative(self):
     self.__assert_resolve_fp(DIR_FP_IN_CONFLICT)
     os.chdir(DIR)
@@ -846,6 +1318,69 @@ class TestFilePathProcessor(TestFile):
       self.assertFalse(SYMLINK_TARGET_FP in files)
 
 
+class TestSubcommandRegistry(TestCore):
+
+  def setUp(self):
+    super(TestSubcommandRegistry, self).setUp()
+    utils_lib.git('commit', '--allow-empty', '-m', 'init')
+
+  def test_registry_matches_parsers(self):
+    for sub_cmd in gl.SUBCOMMANDS:
+      parser = gl.build_parser([sub_cmd], self.repo)
+      subparsers_action = parser._subparsers._group_actions[0]
+      self.assertCountEqual(
+          [sub_cmd.name] + sub_cmd.aliases, subparsers_action.choices)
+      self.assertEqual(
+          sub_cmd.help, subparsers_action._choices_actions[0].help)
+
+  def test_lookup_subcommand(self):
+    self.assertEqual('status', gl.lookup_subcommand(['status']).name)
+    self.assertEqual('status', gl.lookup_subcommand(['st', 'f']).name)
+    self.assertIsNone(gl.lookup_subcommand([]))
+    self.assertIsNone(gl.lookup_subcommand(['--help']))
+    self.assertIsNone(gl.lookup_subcommand(['nonexistent']))
+
+
+class TestCompletion(TestCore):
+
+  def setUp(self):
+    super(TestCompletion, self).setUp()
+    utils_lib.git('commit', '--allow-empty', '-m', 'init')
+    utils_lib.git('branch', 'develop')
+
+  def test_parser_from_spec(self):
+    parser = gl.build_parser(gl.SUBCOMMANDS, self.repo)
+    parser_spec = json.loads(json.dumps(completion.spec(parser)))
+    refs = {completion.BRANCH: ['develop', 'master'],
+            completion.REMOTE_BRANCH: [], completion.TAG: [],
+            completion.REMOTE: []}
+    rebuilt = completion.from_spec(parser_spec, refs)
+
+    subparsers = parser._subparsers._group_actions[0].choices
+    rebuilt_subparsers = rebuilt._subparsers._group_actions[0].choices
+    self.assertCountEqual(subparsers, rebuilt_subparsers)
+    for name, subparser in subparsers.items():
+      self.assertEqual(
+          [a.option_strings for a in subparser._actions],
+          [a.option_strings for a in rebuilt_subparsers[name]._actions])
+
+    branch_arg = rebuilt_subparsers['switch']._actions[1]
+    self.assertEqual(['develop', 'master'], list(branch_arg.completer()))
+    self.assertEqual(
+        ['develop', 'master'],
+        list(subparsers['switch']._actions[1].completer()))
+
+  def test_stamp(self):
+    git_dir = completion._find_git_dir(os.getcwd())
+    self.assertEqual(
+        os.path.realpath(self.path), os.path.dirname(os.path.realpath(git_dir)))
+    stamp = completion._stamp(git_dir, gl.__version__)
+    self.assertEqual(stamp, completion._stamp(git_dir, gl.__version__))
+    self.assertNotEqual(stamp, completion._stamp(git_dir, 'other version'))
+    utils_lib.git('branch', 'feature')
+    self.assertNotEqual(stamp, completion._stamp(git_dir, gl.__version__))
+
+
 # Unit tests for branch related operations
 
 class TestBranch(TestCore):
@@ -958,6 +1493,20 @@ class TestBranchSwitch(TestBranch):
     self.assertTrue(st)
     self.assertEqual(core.GL_STATUS_UNTRACKED, st.type)
 
+  def test_switch_file_classification_is_mantained_special_chars(self):
+    fps = [TRACKED_FP_WITH_SPACE, 'f\u00e9']
+    for fp in fps:
+      utils_lib.write_file(fp)
+      utils_lib.git('add', fp)
+    utils_lib.git('commit', '-m', 'special chars')
+    for fp in fps:
+      self.curr_b.untrack_file(fp)
+    self.repo.switch_current_branch(self.repo.lookup_branch(BRANCH))
+    self.repo.switch_current_branch(self.repo.lookup_branch('master'))
+    for fp in fps:
+      self.assertEqual(
+          core.GL_STATUS_UNTRACKED, self.curr_b.status_file(fp).type)
+
   def test_switch_with_hidden_files(self):
     hf = '.file'
     utils_lib.write_file(hf)
@@ -5,10 +5,16 @@
 """End-to-end test."""
 
 
+import json
 import logging
 import os
 import re
+import signal
+import socket
+import subprocess
+import tempfile
 import time
+import unittest
 from subprocess import CalledProcessError
 import sys
 
@@ -54,6 +60,11 @@ class TestNotInRepo(utils.TestBase):
       'status', 'diff', 'commit', 'branch', 'merge', 'fuse', 'remote',
       'publish', 'history')
 
+  def test_version_and_help(self):
+    self.assertTrue('GL Version' in utils.gl('--version'))
+    self.assertTrue('status' in utils.gl('--help'))
+    self.assertTrue('status' in utils.gl())
+
 
 class TestBasic(TestEndToEnd):
 
@@ -278,6 +289,133 @@ class TestStatus(TestEndToEnd):
     if (self.UNTRACKED_DIR_FP in st) or (rel_untracked not in st):
       self.fail()
 
+  def test_status_paths(self):
+    utils.write_file(self.TRACKED_DIR_FP, contents='some modifications')
+    utils.write_file('top')
+    st = utils.gl('status', self.DIR)
+    self.assertIn(self.TRACKED_DIR_FP, st)
+    self.assertIn(self.UNTRACKED_DIR_FP, st)
+    self.assertNotIn('top', st)
+
+    os.chdir(self.DIR)
+    self.assertIn('top', utils.gl('status'))
+    utils.git('config', 'gitless.statusLimitToCwd', 'true')
+    st = utils.gl('status')
+    self.assertIn('file1', st)
+    self.assertNotIn('top', st)
+
+  def test_status_untracked_dir(self):
+    utils.write_file(os.path.join('new_dir', 'f1'))
+    utils.write_file(os.path.join('new_dir', 'sub', 'f2'))
+    st = utils.gl('status')
+    self.assertIn('new_dir' + os.sep, st)
+    self.assertNotIn('f1', st)
+    utils.git('config', 'gitless.collapseUntrackedDirs', 'false')
+    st = utils.gl('status')
+    self.assertIn(os.path.join('new_dir', 'f1'), st)
+    self.assertIn(os.path.join('new_dir', 'sub', 'f2'), st)
+
+  def test_status_porcelain(self):
+    utils.write_file(self.TRACKED_DIR_FP, contents='some modifications')
+    utils.write_file(os.path.join('new_dir', 'f'))
+    os.chdir(self.DIR)  # paths are still relative to the root
+    out = utils.gl('status', '--porcelain')
+    self.assertEqual(
+        sorted([
+            'tracked 1 1 1 0 dir/file1', 'untracked 0 1 1 0 dir/file2',
+            'untracked 0 1 1 0 new_dir/']),
+        sorted(out.splitlines()))
+    out = utils.gl('status', '--porcelain', '-z', 'file1')
+    self.assertEqual('tracked 1 1 1 0 dir/file1\0', out)
+
+  def test_status_json(self):
+    utils.write_file(self.TRACKED_DIR_FP, contents='some modifications')
+    records = [json.loads(l) for l in utils.gl('status', '--json').splitlines()]
+    self.assertIn(
+        {'fp': 'dir/file1', 'type': 'tracked', 'exists_at_head': True,
+         'exists_in_wd': True, 'modified': True, 'in_conflict': False},
+        records)
+    self.assertEqual(
+        ['dir/file1', 'dir/file2'], sorted(r['fp'] for r in records))
+    self.assertRaises(
+        CalledProcessError, utils.gl, 'status', '--json', '--porcelain')
+
+  @unittest.skipUnless(
+      sys.platform.startswith('linux'), 'inotify is linux only')
+  def test_status_watch(self):
+    out_fp = os.path.join(self.path, '.git', 'watch_out')
+    env = dict(os.environ, GL_NO_DAEMON='1')
+    with open(out_fp, 'w') as out:
+      p = subprocess.Popen(
+          ['gl', 'status', '--watch'], stdout=out, stderr=out, env=env)
+    self.addCleanup(p.wait)
+    self.addCleanup(p.send_signal, signal.SIGINT)
+
+    def wait_for(*lines):
+      for _ in range(100):
+        with open(out_fp) as f:
+          out = f.read()
+        if all(l in out for l in lines):
+          return out
+        time.sleep(0.05)
+      self.fail('{0} not in output "{1}"'.format(lines, out))
+
+    wait_for(self.UNTRACKED_DIR_FP)
+    utils.write_file(self.TRACKED_DIR_FP, contents='some modifications')
+    wait_for('Tracked files with modifications:\n    ' + self.TRACKED_DIR_FP)
+    utils.write_file(os.path.join('new_dir', 'f'))
+    wait_for('Untracked files:\n    new_dir' + os.sep)
+    utils.gl('commit', '-m', 'commit')
+    out = wait_for(
+        'No longer modified or untracked:\n    ' + self.TRACKED_DIR_FP)
+    # Only the entries that changed are shown again
+    self.assertEqual(1, out.count('    new_dir' + os.sep))
+
+  @unittest.skipUnless(
+      sys.platform.startswith('linux'), 'inotify is linux only')
+  def test_status_watch_paths(self):
+    out_fp = os.path.join(self.path, '.git', 'watch_out')
+    # (out of the repo, writing to it would be a change to watch)
+    trace_dir = tempfile.mkdtemp(prefix='gl-e2e-trace')
+    self.addCleanup(utils.rmtree, trace_dir)
+    trace_fp = os.path.join(trace_dir, 'trace')
+    env = dict(os.environ, GL_NO_DAEMON='1', GL_TRACE=trace_fp)
+    with open(out_fp, 'w') as out:
+      p = subprocess.Popen(
+          ['gl', 'status', '--watch', self.DIR], stdout=out, stderr=out,
+          env=env)
+    self.addCleanup(p.wait)
+    self.addCleanup(p.send_signal, signal.SIGINT)
+
+    def wait_for(line):
+      for _ in range(100):
+        with open(out_fp) as f:
+          out = f.read()
+        if line in out:
+          return
+        time.sleep(0.05)
+      self.fail('{0} not in output "{1}"'.format(line, out))
+
+    def statuses():
+      # (the status of the given paths is logged as it ends)
+      with open(trace_fp) as f:
+        return f.read().count(' status paths=')
+
+    wait_for(self.UNTRACKED_DIR_FP)
+    utils.write_file(self.TRACKED_DIR_FP, contents='some modifications')
+    wait_for('Tracked files with modifications:\n    ' + self.TRACKED_DIR_FP)
+    # Once nothing changes, nothing is statused again
+    time.sleep(0.5)
+    count = statuses()
+    time.sleep(1)
+    self.assertEqual(count, statuses())
+    # Nor is it if what changes is not under the paths being watched
+    utils.write_file('top')
+    time.sleep(1)
+    self.assertEqual(count, statuses())
+    utils.write_file(os.path.join(self.DIR, 'new'))
+    wait_for('Untracked files:\n    ' + os.path.join(self.DIR, 'new'))
+
 
 class TestBranch(TestEndToEnd):
 
@@ -430,6 +568,101 @@ class TestDiffFile(TestEndToEnd):
       self.fail('out is ' + out2)
     self.assertEqual(out1, out2)
 
+  def test_diff_stat(self):
+    utils.write_file(self.TRACKED_FP, contents='1\n2\n')
+    utils.write_file(self.DIR_TRACKED_FP, contents='dir contents\n')
+    self.assertEqual(
+        ' {0} | 2 +-\n'
+        ' {1}     | 3 ++-\n'
+        ' 2 files changed, 3 insertions(+), 2 deletions(-)\n'.format(
+            self.DIR_TRACKED_FP, self.TRACKED_FP),
+        utils.gl('diff', '--stat'))
+    self.assertEqual(
+        '1\t1\t{0}\n2\t1\t{1}\n'.format(
+            self.DIR_TRACKED_FP, self.TRACKED_FP),
+        utils.gl('diff', '--numstat'))
+    self.assertEqual(
+        '{0}\n{1}\n'.format(self.DIR_TRACKED_FP, self.TRACKED_FP),
+        utils.gl('diff', '--name-only'))
+    self.assertEqual(
+        '{0}\n'.format(self.TRACKED_FP),
+        utils.gl('diff', '--name-only', self.TRACKED_FP))
+
+  def test_diff_commit_point(self):
+    utils.write_file(self.TRACKED_FP, contents='contents\n')
+    utils.gl('commit', '-m', 'change', self.TRACKED_FP)
+    utils.write_file(self.DIR_TRACKED_FP, contents='dir contents\n')
+    out = utils.gl('diff', '-cp', 'HEAD^..HEAD')
+    if '+contents' not in out or self.DIR_TRACKED_FP in out:
+      self.fail('out is ' + out)
+    self.assertEqual(
+        '{0}\n{1}\n'.format(self.DIR_TRACKED_FP, self.TRACKED_FP),
+        utils.gl('diff', '-cp', 'HEAD^', '--name-only'))
+    self.assertEqual(
+        '{0}\n'.format(self.DIR_TRACKED_FP),
+        utils.gl('diff', '-cp', 'HEAD', '--name-only'))
+    self.assertEqual(
+        '{0}\n'.format(self.TRACKED_FP),
+        utils.gl('diff', '-cp', 'HEAD^', '--name-only', self.TRACKED_FP))
+
+    utils.gl('commit', '-m', 'change dir', self.DIR_TRACKED_FP)
+    os.rename(self.DIR_TRACKED_FP, 'renamed')
+    utils.gl('track', 'renamed')
+    utils.gl('commit', '-m', 'rename')
+    self.assertEqual(
+        '{0} => renamed\n'.format(self.DIR_TRACKED_FP),
+        utils.gl('diff', '-cp', 'HEAD^..', '--find-renames', '--name-only'))
+    self.assertRaises(
+        CalledProcessError, utils.gl, 'diff', '-cp', 'nonexistent')
+
+  def test_diff_jobs(self):
+    fps = ['f{0}'.format(i) for i in range(120)]
+    for fp in fps:
+      utils.write_file(fp, contents='contents\n')
+    utils.gl('commit', '-m', 'add files', *fps)
+    for fp in fps:
+      utils.write_file(fp, contents='new contents of {0}\n'.format(fp))
+    utils.write_file(self.TRACKED_FP, contents='contents')
+    out1 = utils.gl('diff', '-j', '1')
+    if '+new contents of f119' not in out1:
+      self.fail('out is ' + out1)
+    out4 = utils.gl('diff', '-j', '4')
+    self.assertEqual(out1, out4)
+
+
+@unittest.skipIf(sys.platform == 'win32', 'needs a pseudo-terminal')
+class TestPager(TestEndToEnd):
+
+  def _gl_tty(self, *args):
+    """Runs gl with its stdout connected to a terminal (so that it pages)."""
+    import pty
+    master, slave = pty.openpty()
+    try:
+      p = subprocess.run(
+          ['gl', *args], stdout=slave, stderr=subprocess.PIPE,
+          encoding=utils.ENCODING, timeout=60)
+      return p.returncode, p.stderr, os.read(master, 1024).decode()
+    finally:
+      os.close(slave)
+      os.close(master)
+
+  def test_pager_quits_early(self):
+    # Much more output than what fits in a pipe
+    utils.write_file('f', contents=''.join(
+        'line {0}\n'.format(i) for i in range(20000)))
+    utils.gl('commit', '-m', 'big commit', 'f')
+    utils.git('config', 'core.pager', 'head -n 1')
+    code, err, out = self._gl_tty('history', '-v')
+    self.assertEqual(0, code)
+    self.assertEqual('', err)
+    self.assertTrue(out.startswith('Commit Id:'), msg=out)
+
+    utils.write_file('f', contents='new contents\n')
+    code, err, out = self._gl_tty('diff')
+    self.assertEqual(0, code)
+    self.assertEqual('', err)
+    self.assertTrue(out.startswith('Diff summary'), msg=out)
+
 
 class TestOp(TestEndToEnd):
 
@@ -714,6 +947,166 @@ class TestMerge(TestOp):
     self.assertTrue('contents 2' in contents)
 
 
+class TestTrace(TestEndToEnd):
+
+  def test_trace(self):
+    trace_fp = os.path.join(self.path, '.trace')
+    utils.write_file('f1')
+    os.environ['GL_TRACE'] = trace_fp
+    try:
+      utils.gl('track', 'f1')
+      utils.gl('untrack', 'f1')
+    finally:
+      del os.environ['GL_TRACE']
+    trace = utils.read_file(trace_fp)
+    self.assertTrue(re.search(r'ms pygit2\.status_file path=.f1.', trace))
+    self.assertTrue('event' in trace and 'count' in trace)
+    self.assertTrue('gl track' in trace and 'gl untrack' in trace)
+
+    os.remove(trace_fp)
+    utils.gl('status')
+    self.assertFalse(os.path.exists(trace_fp))
+
+  def test_trace_option(self):
+    def stderr(*args):
+      return subprocess.run(
+          ['gl', *args], capture_output=True, check=True, text=True).stderr
+    self.assertTrue('gl-trace: ' in stderr('--trace', 'status'))
+    self.assertTrue('gl-trace: ' in stderr('--trace', '--trace', 'status'))
+    # Abbreviations are not taken (main only looks for --trace as is)
+    self.assertRaisesRegexp(
+        CalledProcessError, 'unrecognized arguments: --tr',
+        utils.gl, '--tr', 'status')
+
+
+@unittest.skipUnless(
+    hasattr(socket, 'send_fds') and hasattr(os, 'fork'),
+    'gl daemon is not supported on this platform')
+class TestDaemon(TestEndToEnd):
+
+  def setUp(self):
+    super(TestDaemon, self).setUp()
+    os.environ['GL_DAEMON_SOCKET'] = os.path.join(self.path, '.gl-daemon')
+    utils.gl('daemon')
+
+  def tearDown(self):
+    try:
+      utils.gl('daemon', '--stop')
+    except CalledProcessError:
+      pass
+    del os.environ['GL_DAEMON_SOCKET']
+    super(TestDaemon, self).tearDown()
+
+  def test_daemon(self):
+    def assert_same_as_without_daemon(*args, **kwargs):
+      out = utils.gl(*args, **kwargs)
+      os.environ['GL_NO_DAEMON'] = '1'
+      try:
+        self.assertEqual(out, utils.gl(*args, **kwargs))
+      finally:
+        del os.environ['GL_NO_DAEMON']
+
+    utils.write_file('file1', 'Contents of file1')
+    assert_same_as_without_daemon('status')
+    utils.gl('track', 'file1')
+    # The daemon must notice that the repo changed
+    self.assertTrue('file1 (new file)' in utils.gl('status'))
+    utils.gl('commit', '-m', 'file1 commit')
+    assert_same_as_without_daemon('history')
+    os.mkdir('dir')
+    assert_same_as_without_daemon('status', cwd='dir')
+    self.assertRaisesRegexp(
+        CalledProcessError, 'already running', utils.gl, 'daemon')
+    # Exit codes and stderr get to the client
+    self.assertRaisesRegexp(
+        CalledProcessError, 'No files to commit', utils.gl, 'commit', '-m', 'x')
+
+    utils.gl('daemon', '--stop')
+    self.assertFalse(os.path.exists(os.environ['GL_DAEMON_SOCKET']))
+    # Without a daemon gl runs commands itself
+    self.assertTrue('file1' in utils.gl('history'))
+
+  def test_socket_dir_not_private(self):
+    utils.gl('daemon', '--stop')
+    env = dict(os.environ)
+    try:
+      del os.environ['GL_DAEMON_SOCKET']
+      os.environ.pop('XDG_RUNTIME_DIR', None)
+      os.environ['TMPDIR'] = self.path
+      # Someone else could have created it (and put their own socket in it)
+      sock_dir = os.path.join(self.path, 'gl-daemon-{0}'.format(os.getuid()))
+      # Only the daemon creates it
+      utils.gl('status')
+      self.assertFalse(os.path.exists(sock_dir))
+      os.mkdir(sock_dir, 0o777)
+      os.chmod(sock_dir, 0o777)
+      self.assertRaisesRegexp(
+          CalledProcessError, 'not a directory only you have access to',
+          utils.gl, 'daemon')
+      self.assertFalse(os.listdir(sock_dir))
+      # Commands are still run, just not on a daemon
+      utils.gl('status')
+
+      os.chmod(sock_dir, 0o700)
+      utils.gl('daemon')
+      try:
+        self.assertEqual(['sock'], os.listdir(sock_dir))
+        utils.gl('status')
+      finally:
+        utils.gl('daemon', '--stop')
+    finally:
+      os.environ.clear()
+      os.environ.update(env)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is linux only')
+class TestDaemonWatch(TestDaemon):
+
+  def setUp(self):
+    super(TestDaemonWatch, self).setUp()
+    utils.gl('daemon', '--stop')
+    utils.gl('daemon', '--watch')
+
+  def test_status(self):
+    def assert_same_as_without_daemon():
+      out = utils.gl('status')
+      os.environ['GL_NO_DAEMON'] = '1'
+      try:
+        self.assertEqual(out, utils.gl('status'))
+      finally:
+        del os.environ['GL_NO_DAEMON']
+      return out
+
+    utils.write_file('file1', 'Contents of file1')
+    utils.write_file('dir/file2', 'Contents of file2')
+    utils.gl('track', 'file1', 'dir/file2')
+    assert_same_as_without_daemon()
+    utils.write_file('file1', 'New contents of file1')
+    utils.write_file('dir/sub/file3')
+    self.assertTrue('dir/sub' in assert_same_as_without_daemon())
+    utils.gl('commit', '-m', 'file1 commit')
+    assert_same_as_without_daemon()
+    os.rename('dir', 'renamed')
+    self.assertTrue('renamed' in assert_same_as_without_daemon())
+
+  def test_diff(self):
+    trace_fp = os.path.join(self.path, '.git', 'trace')
+    utils.write_file('file1', 'Contents of file1')
+    utils.gl('track', 'file1')
+    utils.gl('commit', '-m', 'file1 commit')
+    utils.write_file('file1', 'New contents of file1')
+    os.environ['GL_TRACE'] = trace_fp
+    try:
+      self.assertTrue('New contents' in utils.gl('diff'))
+      utils.write_file('file1', 'Newer contents of file1')
+      # Only the paths that changed are looked at
+      self.assertTrue('Newer contents' in utils.gl('diff'))
+    finally:
+      del os.environ['GL_TRACE']
+    trace = utils.read_file(trace_fp)
+    self.assertTrue(re.search(r'ms fsmonitor changed=1\b', trace), trace)
+
+
 class TestPerformance(TestEndToEnd):
 
   FPS_QTY = 10000
@@ -750,6 +1143,85 @@ class TestPerformance(TestEndToEnd):
     logging.info('Done')
     assert_status_performance()
 
+  def _status_threads_setup(self):
+    for i in range(0, self.FPS_QTY):
+      fp = os.path.join('d' + text(i % 100), 'f' + text(i))
+      utils.write_file(fp, fp)
+    utils.git('add', '.')
+    utils.git('config', 'gitless.statusCache', 'false')
+
+  def test_status_threads_performance(self):
+    # This is only a guard against threads making things a lot worse: the
+    # files are in the page cache here, so stat calls are fast and threads
+    # can't do much. See test_status_threads_cold_cache for the benchmark.
+    # The test fails if `gl status` with threads takes more than 3 times the
+    # time it takes without them
+    MAX_TOLERANCE = 3
+
+    self._status_threads_setup()
+
+    def status(threads):
+      utils.git('config', 'gitless.statusThreads', text(threads))
+      t = time.time()
+      out = utils.gl('status')
+      return out, time.time() - t
+
+    out, serial_t = status(1)
+    threads_out, threads_t = status(8)
+    self.assertEqual(out, threads_out)
+    logging.info('serial_t {0}, threads_t {1}'.format(serial_t, threads_t))
+    self.assertTrue(
+        threads_t < serial_t*MAX_TOLERANCE,
+        msg='serial_t {0}, threads_t {1}'.format(serial_t, threads_t))
+
+  @unittest.skipUnless(
+      os.environ.get('GL_BENCH_DROP_CACHES') == '1',
+      'set GL_BENCH_DROP_CACHES=1 to run (it drops the page cache of the '
+      'whole system, as root on Linux)')
+  def test_status_threads_cold_cache(self):
+    # Benchmarks `gl status` with and without threads when the files and dirs
+    # of the repo are not in the kernel's caches (as after a reboot), which is
+    # when threads should help (by having libgit2 wait on several stat calls
+    # at once). The speedup is logged: it depends on the disk (and on the
+    # number of cpus), so the test only fails if threads make things a lot
+    # worse. Dropping the caches affects the whole system, so it's opt-in
+    MAX_TOLERANCE = 3
+    ROUNDS = 3
+
+    self._status_threads_setup()
+    # We warm up gl itself in another repo so that loading Python and gl's
+    # modules is not part of what's measured
+    warm_path = tempfile.mkdtemp(prefix='gl-e2e-warm')
+    utils.gl('init', cwd=warm_path)
+
+    def status(threads):
+      utils.git('config', 'gitless.statusThreads', text(threads))
+      subprocess.run(['sync'], check=True)
+      with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+      utils.gl('status', cwd=warm_path)
+      t = time.time()
+      out = utils.gl('status')
+      return out, time.time() - t
+
+    try:
+      serial_ts, threads_ts = [], []
+      for _ in range(ROUNDS):
+        out, serial_t = status(1)
+        threads_out, threads_t = status(8)
+        self.assertEqual(out, threads_out)
+        serial_ts.append(serial_t)
+        threads_ts.append(threads_t)
+    finally:
+      utils.rmtree(warm_path)
+    serial_t, threads_t = min(serial_ts), min(threads_ts)
+    logging.info(
+        'cold cache: serial_t {0:.3f}, threads_t {1:.3f}, speedup {2:.2f}x'
+        .format(serial_t, threads_t, serial_t / threads_t))
+    self.assertTrue(
+        threads_t < serial_t*MAX_TOLERANCE,
+        msg='serial_t {0}, threads_t {1}'.format(serial_t, threads_t))
+
   def test_branch_switch_performance(self):
     MAX_TOLERANCE = 100
 
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""Opt-in tracing of the git processes we run and the main libgit2 calls.
+
+Tracing is enabled by setting GL_TRACE (or passing --trace to gl). As with
+GIT_TRACE, if GL_TRACE is 1 or true the trace goes to stderr and if it's an
+absolute path it's appended to that file. Each event is logged as it ends and
+a summary table with the count and time spent per event is logged when the
+command finishes.
+"""
+
+
+import collections
+import contextlib
+import os
+import sys
+import time
+
+
+# name -> [count, total time, max time]
+_totals = collections.OrderedDict()
+
+
+def enabled():
+  # The environment is checked each time (instead of once) since gl daemon
+  # runs commands with the environment of the client
+  return os.environ.get('GL_TRACE', '').lower() not in ('', '0', 'false')
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+  """Times the code in the with block and logs it as an event called name.
+
+  Yields a dict of attributes (initially attrs) that are logged along with the
+  event, code in the with block can add more to it (e.g., the size of the
+  output of a call).
+  """
+  if not enabled():
+    yield attrs
+    return
+  start = time.perf_counter()
+  try:
+    yield attrs
+  finally:
+    _record(name, time.perf_counter() - start, attrs)
+
+
+def iterate(name, iterable, **attrs):
+  """Returns an iterator over iterable that logs the time spent getting items.
+
+  The time spent by the caller in between items is not included. The event is
+  logged once the iteration finishes (or the iterator is discarded). Other
+  attributes are forwarded to iterable so that, for example, a traced pygit2
+  Walker can still be used as one.
+  """
+  if not enabled():
+    return iterable
+  return _TracedIterator(name, iterable, attrs)
+
+
+def summary():
+  """Logs a table with the count and time spent per event so far."""
+  if not enabled() or not _totals:
+    return
+  width = max(len(name) for name in _totals)
+  lines = ['{0:<{w}} {1:>7} {2:>11} {3:>11}'.format(
+      'event', 'count', 'total (ms)', 'max (ms)', w=width)]
+  for name, (count, total, max_t) in sorted(
+      _totals.items(), key=lambda item: item[1][1], reverse=True):
+    lines.append('{0:<{w}} {1:>7} {2:>11.3f} {3:>11.3f}'.format(
+        name, count, total * 1000, max_t * 1000, w=width))
+  _write('\n'.join(lines))
+
+
+# Private functions
+
+
+class _TracedIterator(object):
+
+  def __init__(self, name, iterable, attrs):
+    self._name = name
+    self._iterable = iterable
+    self._it = None
+    self._attrs = attrs
+    self._elapsed = 0
+    self._qty = 0
+    self._done = False
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    start = time.perf_counter()
+    try:
+      if self._it is None:
+        self._it = iter(self._iterable)
+      item = next(self._it)
+    except StopIteration:
+      self._finish(start)
+      raise
+    self._elapsed += time.perf_counter() - start
+    self._qty += 1
+    return item
+
+  def __getattr__(self, name):
+    return getattr(self._iterable, name)
+
+  def __del__(self):
+    self._finish(time.perf_counter())
+
+  def _finish(self, start):
+    if not self._done:
+      self._done = True
+      self._elapsed += time.perf_counter() - start
+      self._attrs['items'] = self._qty
+      _record(self._name, self._elapsed, self._attrs)
+
+
+def _record(name, duration, attrs):
+  totals = _totals.setdefault(name, [0, 0, 0])
+  totals[0] += 1
+  totals[1] += duration
+  totals[2] = max(totals[2], duration)
+  _write('{0:.3f}ms {1}{2}'.format(
+      duration * 1000, name,
+      ''.join(' {0}={1!r}'.format(k, v) for k, v in attrs.items())))
+
+
+def _write(msg):
+  msg = ''.join('gl-trace: {0}\n'.format(l) for l in msg.splitlines())
+  dst = os.environ.get('GL_TRACE')
+  if os.path.isabs(dst):
+    with open(dst, 'a') as f:
+      f.write(msg)
+  else:
+    sys.stderr.write(msg)
+    sys.stderr.flush()
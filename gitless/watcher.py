@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# Gitless - a version control system built on top of Git
+# Licensed under MIT
+
+"""Watch the working directory of a repository for changes (Linux only).
+
+A Watcher uses inotify to keep track of the paths that changed in the working
+directory of a repository. Clients get a token along with the changes, with
+which they can later ask for the paths that changed since then. This is what
+gl daemon uses to provide an fsmonitor to the repositories gl opens (see
+core.Repository).
+
+Only the standard library is used (inotify is called via ctypes) so that the
+daemon doesn't need anything else.
+"""
+
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import posixpath
+import struct
+import sys
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR |
+    IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+# struct inotify_event is followed by the (NUL padded) name
+_EVENT = struct.Struct('iIII')
+
+# If more paths than this change we forget about them and have clients look at
+# everything (as we do if the kernel's event queue overflows)
+MAX_CHANGES = 100000
+
+
+def is_supported():
+  return sys.platform.startswith('linux') and _libc() is not None
+
+
+class Watcher(object):
+  """Watches the working directory of a repository.
+
+  Directories are watched recursively (except for .git dirs). Changes are
+  recorded as they are read, which happens whenever read_events is called
+  (e.g., when fileno is ready to be read) and before answering changes_since.
+
+  Attributes:
+    root: the root of the working directory being watched.
+    alive: False if the root is gone (and nothing is being watched anymore).
+
+  Args:
+    root: the root of the working directory to watch.
+
+  Raises:
+    OSError: if watching fails (e.g., because the limit of watches per user
+      was reached).
+  """
+
+  def __init__(self, root):
+    self.root = root
+    self.alive = True
+    libc = _libc()
+    self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self._fd < 0:
+      raise _os_error()
+    self._wds = {}  # watch descriptor -> dir (relative to root)
+    self._changes = {}  # path (relative to root) -> seq of its last change
+    self._seq = 0
+    self._reset()
+    try:
+      self._watch_tree('')
+    except OSError:
+      self.close()
+      raise
+
+  def fileno(self):
+    return self._fd
+
+  def close(self):
+    self.alive = False
+    if self._fd >= 0:
+      os.close(self._fd)
+      self._fd = -1
+
+  def changes_since(self, token):
+    """Returns a new token and the paths that changed since token.
+
+    The paths (relative to the root, with forward slashes) are None if the
+    changes since token are not known (e.g., the token is from another watcher
+    or some events were lost), in which case the client should look at
+    everything. A path of a directory means anything under it could have
+    changed.
+    """
+    self.read_events()
+    new_token = '{0}:{1}'.format(self._id, self._seq)
+    if not self.alive:
+      return new_token, None
+    try:
+      token_id, token_seq = token.split(':')
+      token_seq = int(token_seq)
+    except (AttributeError, ValueError):
+      return new_token, None
+    if token_id != self._id or token_seq > self._seq:
+      return new_token, None
+    return new_token, sorted(
+        path for path, seq in self._changes.items() if seq > token_seq)
+
+  def read_events(self):
+    """Reads (and records) the events that are pending."""
+    while self._fd >= 0:
+      try:
+        data = os.read(self._fd, 64 * 1024)
+      except BlockingIOError:
+        return
+      pos = 0
+      while pos < len(data):
+        wd, mask, _, name_len = _EVENT.unpack_from(data, pos)
+        pos += _EVENT.size
+        name = os.fsdecode(data[pos:pos + name_len].rstrip(b'\0'))
+        pos += name_len
+        self._handle(wd, mask, name)
+
+
+  # Private methods
+
+  def _handle(self, wd, mask, name):
+    if mask & IN_Q_OVERFLOW:
+      self._reset()
+      return
+    d = self._wds.get(wd)
+    if d is None:
+      return
+    if mask & IN_IGNORED:  # the watch was removed
+      del self._wds[wd]
+      return
+    if not name:  # the event is about the watched dir itself
+      if not d and mask & (IN_DELETE_SELF | IN_MOVE_SELF):  # the root is gone
+        self.alive = False
+      return
+    if name == '.git':
+      return
+
+    path = posixpath.join(d, name)
+    if mask & IN_ISDIR and mask & IN_MOVED_FROM:
+      # The watches of the dir (and of its subdirs) now watch some other place
+      prefix = path + '/'
+      for dir_wd, dir_path in list(self._wds.items()):
+        if dir_path == path or dir_path.startswith(prefix):
+          _libc().inotify_rm_watch(self._fd, dir_wd)
+          del self._wds[dir_wd]
+    self._changed(path)
+    if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+      try:
+        self._watch_tree(path)
+      except OSError:  # we can't watch it, so we can't tell what changes
+        self._reset()
+
+  def _changed(self, path):
+    self._seq += 1
+    self._changes[path] = self._seq
+    if len(self._changes) > MAX_CHANGES:
+      self._reset()
+
+  def _reset(self):
+    """Forgets about the changes so far (tokens given out become invalid)."""
+    self._id = os.urandom(8).hex()
+    self._changes.clear()
+
+  def _watch_tree(self, d):
+    libc = _libc()
+    pending = [d]
+    while pending:
+      curr = pending.pop()
+      wd = libc.inotify_add_watch(
+          self._fd, os.fsencode(os.path.join(self.root, curr)), _WATCH_MASK)
+      if wd < 0:
+        err = _os_error()
+        if err.errno in (errno.ENOENT, errno.ENOTDIR):  # it's already gone
+          continue
+        raise err
+      self._wds[wd] = curr
+      try:
+        with os.scandir(os.path.join(self.root, curr)) as it:
+          pending.extend(
+              posixpath.join(curr, e.name) for e in it
+              if e.name != '.git' and e.is_dir(follow_symlinks=False))
+      except OSError:
+        pass
+
+
+_libc_cache = []
+
+def _libc():
+  if not _libc_cache:
+    libc = None
+    try:
+      libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+      libc.inotify_init1
+    except (OSError, AttributeError):
+      libc = None
+    _libc_cache.append(libc)
+  return _libc_cache[0]
+
+
+def _os_error():
+  err = ctypes.get_errno()
+  return OSError(err, os.strerror(err))
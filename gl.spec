@@ -7,7 +7,17 @@ a = Analysis(['gl.py'],
                # https://github.com/pyinstaller/pyinstaller/issues/3198
                # remove this when dropping support for Python < 3.7
                '_sysconfigdata',
-               '_cffi_backend'],
+               '_cffi_backend',
+               # subcommands are imported lazily by gitless.cli.gl
+               'gitless.cli.gl_track', 'gitless.cli.gl_untrack',
+               'gitless.cli.gl_status', 'gitless.cli.gl_diff',
+               'gitless.cli.gl_commit', 'gitless.cli.gl_branch',
+               'gitless.cli.gl_tag', 'gitless.cli.gl_checkout',
+               'gitless.cli.gl_merge', 'gitless.cli.gl_resolve',
+               'gitless.cli.gl_fuse', 'gitless.cli.gl_remote',
+               'gitless.cli.gl_publish', 'gitless.cli.gl_switch',
+               'gitless.cli.gl_init', 'gitless.cli.gl_history',
+               'gitless.cli.gl_daemon', 'gitless.watcher'],
              hookspath=None,
              runtime_hooks=None)
 